@@ -0,0 +1,304 @@
+"""End-to-end acquisition benchmarks on the Micro-Manager demo devices.
+
+Results get written as json so runs can be compared across commits:
+
+    python benchmarks/bench_acq.py --path /usr/local/lib/micro-manager -o results.json
+
+The live benchmark opens a napari viewer, set QT_QPA_PLATFORM=offscreen on machines without a
+display or skip it with --skip live.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+import xarray as xr
+from qtpy.QtCore import QTimer
+
+import prismo
+from prismo.gui import GUI, LiveClient, tiles_to_image
+
+CONFIG = {
+    "camera": {"device": "demo_camera"},
+    "stage": {"device": "demo_stage"},
+    "filter": {"device": "demo_filter"},
+    "valves": {"device": "demo_valves"},
+}
+
+
+def summarize(seconds):
+    return dict(
+        n=len(seconds),
+        median_s=statistics.median(seconds),
+        p95_s=float(np.percentile(seconds, 95)),
+        min_s=min(seconds),
+    )
+
+
+def bench_snap(ctrl, n):
+    seconds = []
+    for _ in range(n):
+        start = time.perf_counter()
+        ctrl.snap()
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def bench_stream(ctrl, n):
+    start = time.perf_counter()
+    frames = list(ctrl.stream(n))
+    elapsed = time.perf_counter() - start
+    return dict(frames=len(frames), fps=len(frames) / elapsed, dropped=frames[-1].dropped)
+
+
+class LiveCounter:
+    # Runs in the viewer process next to a regular LiveClient and counts the frames that make
+    # it through the Relay and onto the screen.
+    def __init__(self, viewer, relay, seconds, out):
+        self._viewer = viewer
+        self._out = out
+        self._client = LiveClient(viewer, relay, widgets={})
+        self._seqs = []
+        self._start = time.perf_counter()
+        relay.subscribe("img", self.update)
+        QTimer.singleShot(int(1000 * seconds), self.finish)
+
+    def update(self, latest):
+        self._seqs.append(latest[1])
+
+    def finish(self):
+        elapsed = time.perf_counter() - self._start
+        seqs = self._seqs
+        with open(self._out, "w") as f:
+            json.dump(
+                dict(
+                    seconds=elapsed,
+                    frames=len(seqs),
+                    fps=len(seqs) / elapsed,
+                    # Frames the camera produced that the viewer never got to show.
+                    skipped=(seqs[-1] - seqs[0] + 1 - len(seqs)) if seqs else 0,
+                ),
+                f,
+            )
+        self._viewer.close()
+
+
+def bench_live(ctrl, seconds):
+    fd, out = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    gui = GUI(lambda v, r: LiveCounter(v, r, seconds, out))
+    img = gui.frame_buffer(ctrl.snap())
+    produced = [0]
+
+    @gui.worker
+    def snap():
+        with contextlib.closing(ctrl.stream()) as frames:
+            for frame in frames:
+                img.put(frame.img)
+                gui.publish("img", img.latest)
+                produced[0] += 1
+                yield
+
+    start = time.perf_counter()
+    gui.start()
+    try:
+        # Viewer startup isn't part of the measurement but give up if it never reports back.
+        deadline = time.monotonic() + seconds + 120
+        while os.path.getsize(out) == 0:
+            if time.monotonic() > deadline:
+                raise TimeoutError("The viewer never reported its frame rate.")
+            time.sleep(0.1)
+        time.sleep(0.1)
+        with open(out) as f:
+            result = json.load(f)
+    finally:
+        elapsed = time.perf_counter() - start
+        gui.quit()
+        # The live worker has to close its stream before later benchmarks can snap.
+        gui.join()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(out)
+    result["camera_fps"] = produced[0] / elapsed
+    return result
+
+
+def bench_array(ctrl, file, shape, n):
+    dims = dict(zip(["time", "row", "col"], shape, strict=True))
+    gui = GUI(None, file, ctrl.snap(), headless=True)
+    seconds = []
+    try:
+        for i in range(n):
+            start = time.perf_counter()
+            gui.array(f"array{i}", **dims)
+            seconds.append(time.perf_counter() - start)
+    finally:
+        gui.quit()
+    return dict(shape=list(shape), tiles=int(np.prod(shape)), **summarize(seconds))
+
+
+def bench_write(ctrl, file, rows, cols, codec):
+    tile = ctrl.snap()
+    gui = GUI(None, file, tile, dict(overlap=0.1), codec=codec, headless=True)
+    try:
+        xp = gui.array("tiles", row=rows, col=cols)
+        # Different frames so compression doesn't get an unrealistically easy time.
+        frames = [ctrl.snap() for _ in range(min(8, rows * cols))]
+        start = time.perf_counter()
+        for i in range(rows):
+            for j in range(cols):
+                xp[i, j] = frames[(i * cols + j) % len(frames)]
+        queued = time.perf_counter() - start
+        gui.flush()
+        elapsed = time.perf_counter() - start
+    finally:
+        gui.quit()
+    nbytes = rows * cols * tile.nbytes
+    return dict(
+        codec=codec,
+        tiles=rows * cols,
+        mb=nbytes / 1e6,
+        mb_per_s=nbytes / elapsed / 1e6,
+        submit_mb_per_s=nbytes / queued / 1e6,
+    )
+
+
+def bench_open(file, n):
+    seconds = []
+    for _ in range(n):
+        start = time.perf_counter()
+        xp = xr.open_zarr(file, group="tiles")
+        tiles_to_image(xp["tile"].assign_attrs(xp.attrs))
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def bench_access(ctrl, n):
+    def per_op(func):
+        start = time.perf_counter()
+        for _ in range(n):
+            func()
+        return (time.perf_counter() - start) / n
+
+    state = ctrl.filter
+
+    def set_filter():
+        ctrl.filter = state
+
+    return dict(
+        get_state_s=per_op(lambda: ctrl.filter),
+        set_same_state_s=per_op(set_filter),
+        get_device_s=per_op(lambda: ctrl.valves),
+        get_exposure_s=per_op(lambda: ctrl.exposure),
+        get_px_len_s=per_op(lambda: ctrl.px_len),
+        set_valve_s=per_op(lambda: ctrl.valves.__setitem__(0, 1)),
+        wait_s=per_op(ctrl.wait),
+    )
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+BENCHMARKS = ["load", "snap", "stream", "live", "array", "write", "open", "access", "cached"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default=None, help="Micro-Manager installation directory.")
+    parser.add_argument("-n", type=int, default=100, help="Repetitions for latency benchmarks.")
+    parser.add_argument("--live-seconds", type=float, default=5.0)
+    parser.add_argument(
+        "--array-shape", default="100,20,20", help="time,row,col tiles of the created array."
+    )
+    parser.add_argument("--grid", type=int, default=16, help="Rows and cols of the written array.")
+    parser.add_argument("--codec", default="balanced")
+    parser.add_argument("--skip", nargs="*", default=[], choices=BENCHMARKS)
+    parser.add_argument("--json", action="store_true", help="Print raw results as json.")
+    parser.add_argument("-o", "--output", default=None, help="Write results as json to a file.")
+    args = parser.parse_args()
+
+    results = dict(
+        commit=git_commit(),
+        prismo=prismo.__version__,
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        args=vars(args),
+        benchmarks={},
+    )
+
+    def run(name, func, *func_args):
+        if name in args.skip:
+            return
+        # One broken benchmark (e.g. no display for the viewer) shouldn't lose all the others.
+        try:
+            results["benchmarks"][name] = func(*func_args)
+        except Exception:
+            results["benchmarks"][name] = dict(error=traceback.format_exc())
+
+    start = time.perf_counter()
+    ctrl = prismo.load(CONFIG, path=args.path)
+    if "load" not in args.skip:
+        results["benchmarks"]["load"] = dict(
+            total_s=time.perf_counter() - start, devices_s=ctrl.load_times
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run("snap", bench_snap, ctrl, args.n)
+        run("stream", bench_stream, ctrl, args.n)
+        run("live", bench_live, ctrl, args.live_seconds)
+        shape = tuple(int(x) for x in args.array_shape.split(","))
+        run("array", bench_array, ctrl, os.path.join(tmp, "array.zarr"), shape, 3)
+        file = os.path.join(tmp, "write.zarr")
+        run("write", bench_write, ctrl, file, args.grid, args.grid, args.codec)
+        if "write" in results["benchmarks"] and "error" not in results["benchmarks"]["write"]:
+            run("open", bench_open, file, 10)
+        run("access", bench_access, ctrl, 100 * args.n)
+    ctrl.close()
+
+    cached = prismo.load(CONFIG, path=args.path, cache_ttl=float("inf"))
+    run("cached", bench_access, cached, 100 * args.n)
+    if "cached" in results["benchmarks"]:
+        results["benchmarks"]["cached"]["cache_stats"] = cached.cache_stats
+    cached.close()
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name, result in results["benchmarks"].items():
+        if "error" in result:
+            print(f"{name:>7}: failed\n{result['error']}")
+            continue
+        values = ", ".join(
+            f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}"
+            for k, v in result.items()
+            if not isinstance(v, dict)
+        )
+        print(f"{name:>7}: {values}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Cold start benchmark for scripts that only load devices and snap images.
+
+Every run happens in a fresh interpreter so nothing is cached in sys.modules:
+
+    python benchmarks/bench_import.py --path /usr/local/lib/micro-manager
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Modules a plain load + snap should never need.
+HEAVY_MODULES = ["dask", "dill", "napari", "pymodbus", "qtpy", "serial", "xarray", "zarr"]
+
+SCRIPT = """
+import json, sys, time
+
+start = time.perf_counter()
+import prismo
+
+imported = time.perf_counter()
+ctrl = prismo.load({config!r}, path={path!r})
+loaded = time.perf_counter()
+ctrl.snap()
+snapped = time.perf_counter()
+
+print(json.dumps(dict(
+    import_s=imported - start,
+    load_s=loaded - imported,
+    snap_s=snapped - loaded,
+    total_s=snapped - start,
+    heavy_modules=[m for m in {heavy!r} if m in sys.modules],
+)))
+"""
+
+CONFIG = {
+    "camera": {"device": "demo_camera"},
+    "stage": {"device": "demo_stage"},
+    "filter": {"device": "demo_filter"},
+}
+
+
+def run_once(path):
+    script = SCRIPT.format(config=CONFIG, path=path, heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=5)
+    parser.add_argument("--path", default=None, help="Micro-Manager installation directory.")
+    parser.add_argument("--json", action="store_true", help="Print raw results as json.")
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.n)]
+    if args.json:
+        print(json.dumps(runs, indent=2))
+        return
+
+    for key in ["import_s", "load_s", "snap_s", "total_s"]:
+        values = [r[key] for r in runs]
+        print(
+            f"{key:>9}: median {1e3 * statistics.median(values):8.1f} ms  "
+            f"min {1e3 * min(values):8.1f} ms"
+        )
+    heavy = sorted({m for r in runs for m in r["heavy_modules"]})
+    print(f"heavy modules imported: {', '.join(heavy) if heavy else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Round trip benchmark for the fluidic packet framing.
+
+Packets are written to and read back from a pyserial loopback port, so no hardware is needed:
+
+    python benchmarks/bench_packet.py
+"""
+
+import argparse
+import os
+import struct
+import time
+
+from prismo.devices.fluidic.packet import PacketStream, cobs_decode, cobs_encode
+
+
+def bench_codec(payload, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        encoded = cobs_encode(payload)
+    encode_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(n):
+        decoded = cobs_decode(encoded)
+    decode_s = time.perf_counter() - start
+
+    assert decoded == payload
+    return encode_s / n, decode_s / n
+
+
+def bench_round_trip(payload, n):
+    stream = PacketStream(url="loop://")
+    # Writes to the loopback port block once its 4 KiB buffer fills up, so only queue up as many
+    # packets as fit before reading them back.
+    batch = max(1, 4096 // (len(cobs_encode(payload)) + 1))
+    start = time.perf_counter()
+    for _ in range(n // batch):
+        for _ in range(batch):
+            stream.write(payload)
+        for _ in range(batch):
+            assert stream.read() == payload
+    return (time.perf_counter() - start) / max(1, n // batch * batch)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=1000)
+    args = parser.parse_args()
+
+    payloads = {
+        # The same layout FlowController receives for a sensor info request.
+        "sensor_info": struct.pack(">B???dd", 1, False, True, False, 12.5, 21.0),
+        "zeros_1k": bytes(1024),
+        "random_1k": os.urandom(1024),
+    }
+    for name, payload in payloads.items():
+        encode_s, decode_s = bench_codec(payload, args.n)
+        round_trip_s = bench_round_trip(payload, args.n)
+        print(
+            f"{name:>12}: encode {1e6 * encode_s:7.2f} us  decode {1e6 * decode_s:7.2f} us  "
+            f"round trip {1e6 * round_trip_s:7.2f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,33 @@
+import importlib
+from typing import TYPE_CHECKING
+
 __version__ = "0.1.0"
 
-__all__ = ["acq", "live", "load", "multi_acq", "tiled_acq"]
+__all__ = ["acq", "live", "load", "multi_acq", "tiled_acq", "view"]
+
+# The GUI pulls in napari, Qt, dask, xarray and zarr so only import it once it's actually needed,
+# scripts that just load devices and snap images then start up much faster.
+_EXPORTS = {
+    "acq": "prismo.gui",
+    "live": "prismo.gui",
+    "load": "prismo.control",
+    "multi_acq": "prismo.gui",
+    "tiled_acq": "prismo.gui",
+    "view": "prismo.gui",
+}
+
+if TYPE_CHECKING:
+    from prismo.control import load
+    from prismo.gui import acq, live, multi_acq, tiled_acq, view
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-from prismo.control import load
-from prismo.gui import acq, live, multi_acq, tiled_acq
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,11 +1,22 @@
+import collections
+import contextlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pymmcore
 
 import prismo.devices as dev
+from prismo.focus import METRICS, prepare, search
 
 
-def load(config, path=None):
+def load(config, path=None, parallel=True, cache_ttl=None):
+    # Resolve every device, port and reference between devices before touching any hardware so
+    # mistakes in the config fail fast.
+    ports, specs = dev.registry.plan(config)
+
     core = pymmcore.CMMCore()
     if path is None:
         if os.name == "nt":
@@ -16,189 +27,423 @@ def load(config, path=None):
     os.environ["PATH"] += os.pathsep + path
     core.setDeviceAdapterSearchPaths([path])
 
-    devices = []
-    ports = {}
-    port_defaults = {
-        "AnswerTimeout": "500.0",
-        "BaudRate": "9600",
-        "DTR": "Disable",
-        "DataBits": "8",
-        "DelayBetweenCharsMs": "0.0",
-        "Fast USB to Serial": "Disable",
-        "Handshaking": "Off",
-        "Parity": "None",
-        "StopBits": "1",
-        "Verbose": "1",
-    }
-    for name, params in config.items():
-        device = params.get("device")
-        if device is None or device not in (
-            "asi_stage",
-            "asi_zstage",
-            "lambda_filter1",
-            "lambda_filter2",
-            "lambda_shutter1",
-            "lambda_shutter2",
-            "sola_light",
-            "spectra_light",
-        ):
-            continue
-        if "port" not in params:
-            raise ValueError(f"{name} requires a port to be specified.")
-
-        port = params["port"]
-        if device == "asi_stage" or device == "asi_zstage":
-            ports[port] = {**port_defaults, "AnswerTimeout": 2000.0}
-        elif device in ("lambda_filter1", "lambda_filter2", "lambda_shutter1", "lambda_shutter2"):
-            ports[port] = {**port_defaults, "AnswerTimeout": 2000.0, "BaudRate": 128000}
-        elif device == "sola_light" or device == "spectra_light":
-            ports[port] = dict(port_defaults)
+    load_times = {}
 
+    # Every port goes through the same SerialManager adapter so they're initialized one at a time.
     for port, params in ports.items():
+        start = time.perf_counter()
         core.loadDevice(port, "SerialManager", port)
-        if port in config:
-            params.update(config[port])
         for k, v in params.items():
             core.setProperty(port, k, v)
         core.initializeDevice(port)
+        load_times[port] = time.perf_counter() - start
+
+    devices = {}
+    loading_core = LoadingCore(core)
+
+    def init_group(names):
+        for name in names:
+            factory, params, refs = specs[name]
+            start = time.perf_counter()
+            refs = {param: devices[ref] for param, ref in refs.items()}
+            devices[name] = factory.create(name, loading_core, params, refs)
+            load_times[name] = time.perf_counter() - start
+
+    groups = init_groups(specs)
+    try:
+        with ThreadPoolExecutor(max(len(groups), 1) if parallel else 1) as pool:
+            for future in [pool.submit(init_group, group) for group in groups]:
+                future.result()
+    finally:
+        loading_core.loaded()
+
+    load_times = {name: load_times[name] for name in [*ports, *specs]}
+    return Control(
+        core,
+        devices=[devices[name] for name in specs],
+        load_times=load_times,
+        cache_ttl=cache_ttl,
+        groups=groups,
+    )
+
+
+def init_groups(specs):
+    # Devices that share a hub (e.g. ti_scope), a device adapter or a serial port can't be
+    # initialized at the same time so they go in the same group, as do devices and the devices
+    # they refer to. Groups get initialized concurrently while the devices within a group get
+    # initialized one after another.
+    parent = {name: name for name in specs}
+
+    def find(name):
+        while parent[name] != name:
+            name = parent[name]
+        return name
+
+    owners = {}
+    for name, (factory, params, refs) in specs.items():
+        keys = [("group", factory.group)] if factory.group is not None else []
+        if "port" in params:
+            keys.append(("port", params["port"]))
+        for key in keys:
+            parent[find(name)] = find(owners.setdefault(key, name))
+        for ref in refs.values():
+            parent[find(name)] = find(ref)
+
+    groups = {}
+    for name in specs:
+        groups.setdefault(find(name), []).append(name)
+    # Referenced devices have to exist before the devices that use them.
+    return [sorted(group, key=lambda n: len(specs[n][2])) for group in groups.values()]
+
+
+class LoadingCore:
+    # The core's device registry isn't thread safe, so while groups are created concurrently every
+    # core call except the slow initializeDevice holds a lock. Once loaded, devices get the core's
+    # own methods without the lock.
+    def __init__(self, core):
+        self._core = core
+        self._lock = threading.Lock()
+        self._loading = True
+
+    def loaded(self):
+        self._loading = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._core, name)
+        if not self._loading:
+            # Cache it so later lookups don't come through here again.
+            setattr(self, name, attr)
+            return attr
+        if not callable(attr) or name == "initializeDevice":
+            return attr
 
-    for name, params in config.items():
-        if name in ports:
-            continue
-
-        # TODO: Pull out valves so config isn't order dependent.
-        valves = None
-        device = params.pop("device")
-        match device:
-            case "asi_stage":
-                devices.append(dev.asi.Stage(name, core, **params))
-            case "asi_zstage":
-                devices.append(dev.asi.Focus(name, core, **params))
-            case "bsi_camera":
-                devices.append(dev.bsi.Camera(name, core, **params))
-            case "demo_camera":
-                devices.append(dev.demo.Camera(name, core))
-            case "demo_filter":
-                devices.append(dev.demo.Filter(name, core, **params))
-            case "demo_stage":
-                devices.append(dev.demo.Stage(name, core))
-            case "demo_valves":
-                devices.append(dev.demo.Valves(name, **params))
-            case "fluidic_sipper":
-                devices.append(dev.fluidic.Sipper(name, **params))
-            case "fluigent_flowcontroller":
-                devices.append(dev.fluigent.FlowController(name, **params))
-            case "lambda_filter1":
-                devices.append(dev.sutter.Filter(name, core, filter="A", **params))
-            case "lambda_filter2":
-                devices.append(dev.sutter.Filter(name, core, filter="B", **params))
-            case "lambda_filter3":
-                devices.append(dev.sutter.Filter(name, core, filter="C", **params))
-            case "lambda_shutter1":
-                devices.append(dev.sutter.Shutter(name, core, shutter="A", **params))
-            case "lambda_shutter2":
-                devices.append(dev.sutter.Shutter(name, core, shutter="B", **params))
-            case "manual_objective":
-                devices.append(dev.manual.Objective(name, **params))
-            case "microfluidic_chip":
-                devices.append(dev.microfluidic.Chip(name, valves, **params))
-            case "microfluidic_minichip":
-                devices.append(dev.microfluidic.MiniChip(name, valves, **params))
-            case "microfluidic_mux":
-                devices.append(dev.microfluidic.Mux(name, valves, **params))
-            case "microfluidic_valves":
-                devices.append(dev.microfluidic.Valves(name, **params))
-                valves = devices[-1]
-            case "sola_light":
-                devices.append(dev.lumencor.Light(name, core, version="sola", **params))
-            case "spectra_light":
-                devices.append(dev.lumencor.Light(name, core, version="spectra", **params))
-            case "thor_light":
-                devices.append(dev.thor.Light(name, **params))
-            case "ti_filter1":
-                devices.append(dev.ti.Filter(name, core, filter=1, **params))
-            case "ti_filter2":
-                devices.append(dev.ti.Filter(name, core, filter=2, **params))
-            case "ti_lightpath":
-                devices.append(dev.ti.LightPath(name, core, **params))
-            case "ti_focus":
-                devices.append(dev.ti.Focus(name, core))
-            case "ti_objective":
-                devices.append(dev.ti.Objective(name, core, **params))
-            case "ti2_filter1":
-                devices.append(dev.ti2.Filter(name, core, filter=1, **params))
-            case "ti2_filter2":
-                devices.append(dev.ti2.Filter(name, core, filter=2, **params))
-            case "ti2_overheadlight":
-                devices.append(dev.ti2.OverheadLight(name, core, **params))
-            case "ti2_shutter1":
-                devices.append(dev.ti2.Shutter(name, core, shutter=1))
-            case "ti2_shutter2":
-                devices.append(dev.ti2.Shutter(name, core, shutter=2))
-            case "ti2_lightpath":
-                devices.append(dev.ti2.LightPath(name, core, **params))
-            case "ti2_focus":
-                devices.append(dev.ti2.Focus(name, core))
-            case "ti2_objective":
-                devices.append(dev.ti2.Objective(name, core, **params))
-            case "zyla_camera":
-                devices.append(dev.zyla.Camera(name, core, **params))
-            case _:
-                raise ValueError(f"Device {device} is not recognized.")
-
-    return Control(core, devices=devices)
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        return locked
 
 
 class Control:
-    def __init__(self, core, devices):
+    def __init__(self, core, devices, load_times=None, cache_ttl=None, groups=None):
         # We can't directly set self.devices = devices since our overriden method
         # depends on self.devices being set.
         super().__setattr__("devices", devices)
+        super().__setattr__("_devices", {d.name: d for d in devices})
+        # Classify every device once up front without touching the hardware, isinstance checks
+        # against our protocols would evaluate properties like zoom or valves.
+        super().__setattr__("_capabilities", {d.name: dev.capabilities(d) for d in devices})
+        super().__setattr__(
+            "_index",
+            {p: [d for d in devices if p in self._capabilities[d.name]] for p in dev.PROTOCOLS},
+        )
+        super().__setattr__("_states", {d.name for d in self._index[dev.State]})
+        super().__setattr__("_zooms", {d.name for d in self._index[dev.Zoom]})
 
         self._core = core
         self._core.setTimeoutMs(100000)
 
-        self._camera = None
-        for device in self.devices:
-            if isinstance(device, dev.Camera):
-                self._camera = device
-                break
-
-        self._stage = None
-        for device in self.devices:
-            if isinstance(device, dev.Stage):
-                self._stage = device
-                break
-
-        self._focus = None
-        for device in self.devices:
-            if isinstance(device, dev.Focus):
-                self._focus = device
-                break
+        self._camera = next(iter(self._index[dev.Camera]), None)
+        self._stage = next(iter(self._index[dev.Stage]), None)
+        self._focus = next(iter(self._index[dev.Focus]), None)
+        self._px_len = None
+        # Seconds each device (and serial port) took to initialize in load.
+        self.load_times = load_times if load_times is not None else {}
+        # Seconds spent switching between consecutive channels in the last channel_stack.
+        self.switch_times = []
+        # When cache_ttl isn't None, state devices are read from the last value we set or read
+        # as long as it's at most cache_ttl seconds old and setting a device to the state it's
+        # already in is skipped. Use refresh after moving devices by hand.
+        self._cache_ttl = cache_ttl
+        self._cache = {}
+        self._cache_hits = collections.Counter()
+        self._cache_misses = collections.Counter()
+        # Devices in the same group (see init_groups) can't be talked to at the same time, without
+        # groups we play it safe and put every device in the same one.
+        groups = [[d.name for d in devices]] if groups is None else groups
+        self._groups = {name: i for i, group in enumerate(groups) for name in group}
+        # Names of the devices that got commands since the last wait, every device might still be
+        # busy initializing at first.
+        self._dirty = {d.name for d in devices}
+        # Names of the devices we handed out, whoever holds one can send it commands at any time
+        # so they always get waited on.
+        self._handed_out = set()
+        self._dirty_lock = threading.Lock()
+        self._pool = None
+        # Total seconds spent waiting on each device.
+        self.wait_times = collections.Counter()
+
+    def devices_with(self, protocol):
+        return list(self._index[protocol])
 
     def wait(self):
-        for device in self.devices:
-            if isinstance(device, dev.Wait):
-                device.wait()
+        # Only wait on devices that got commands since the last wait, groups concurrently.
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty | self._handed_out, set()
+        devices = {d.name: d for d in self._index[dev.Wait] if d.name in dirty}
+
+        def wait_group(names):
+            for name in names:
+                self._wait_on(devices[name])
+
+        self._run_groups(devices, wait_group)
+
+    def _wait_on(self, device):
+        with self._dirty_lock:
+            self._dirty.discard(device.name)
+        if dev.Wait not in self._capabilities.get(device.name, ()):
+            return
+        start = time.perf_counter()
+        device.wait()
+        self.wait_times[device.name] += time.perf_counter() - start
+
+    def _touch(self, device):
+        if device is not None:
+            with self._dirty_lock:
+                self._dirty.add(device.name)
+        return device
+
+    def _hand_out(self, device):
+        if device is not None:
+            with self._dirty_lock:
+                self._handed_out.add(device.name)
+        return device
+
+    def _run_groups(self, names, func):
+        # Calls func on the device names in each group, with the groups running concurrently.
+        groups = {}
+        for name in names:
+            groups.setdefault(self._groups.get(name), []).append(name)
+        if not groups:
+            return
+        first, *rest = groups.values()
+        if rest and self._pool is None:
+            # Created once and reused, this runs for every tile. We take one group ourselves.
+            self._pool = ThreadPoolExecutor(
+                len(set(self._groups.values())) - 1, thread_name_prefix="prismo-group"
+            )
+        futures = [self._pool.submit(func, group) for group in rest]
+        try:
+            func(first)
+        finally:
+            for future in futures:
+                future.result()
+
+    def refresh(self, *names):
+        # Forget cached values derived from device state, e.g. after someone manually switched
+        # the objective. Only the cached states of names are forgotten if any are given.
+        self._px_len = None
+        if names:
+            for name in names:
+                self._cache.pop(name, None)
+        else:
+            self._cache.clear()
+
+    @property
+    def cache_stats(self):
+        names = sorted(set(self._cache_hits) | set(self._cache_misses))
+        stats = {}
+        for name in names:
+            hits, misses = self._cache_hits[name], self._cache_misses[name]
+            stats[name] = dict(hits=hits, misses=misses, hit_rate=hits / (hits + misses))
+        return stats
 
     @property
     def camera(self):
-        return self._camera
+        return self._hand_out(self._camera)
 
     @camera.setter
     def camera(self, new_camera):
-        self._camera = self.devices[new_camera]
+        self._camera = self._device(new_camera)
+        self._px_len = None
 
     def snap(self):
         return self._camera.snap()
 
+    def stream(self, n=None):
+        return self._camera.stream(n)
+
+    def z_stack(self, zs):
+        # Returns a (z, y, x) stack so the whole thing can be written to an array in one go, e.g.
+        # xp[t, p] = ctrl.z_stack(zs).
+        zs = list(zs)
+        focus = self._focus
+        # A single plane isn't worth setting up a sequence for.
+        if len(zs) > 1 and dev.supports(focus, dev.ZSequence) and focus.z_sequenceable(len(zs)):
+            # Let the drive settle at the first plane so the first frame isn't taken mid move.
+            self.z = zs[0]
+            self.wait()
+            with focus.z_sequence(zs):
+                stack = np.stack([frame.img for frame in self._camera.stream(len(zs))])
+            if len(stack) != len(zs):
+                raise RuntimeError(f"Expected {len(zs)} planes from {focus.name} not {len(stack)}.")
+            return stack
+
+        stack = None
+        for i, z in enumerate(zs):
+            self.z = z
+            self.wait()
+            img = self._camera.snap()
+            if stack is None:
+                stack = np.empty((len(zs), *img.shape), dtype=img.dtype)
+            stack[i] = img
+        return stack
+
+    def autofocus(
+        self,
+        span=20.0,
+        metric="normalized_variance",
+        method="coarse_to_fine",
+        steps=9,
+        tol=0.5,
+        roi=None,
+        downsample=4,
+    ):
+        # Searches span um of z centered on the current z and moves focus to the sharpest plane.
+        # Sweeps go through z_stack so they're streamed on drives that support sequencing.
+        # Returns the best z and a confidence between 0 and 1.
+        if metric not in METRICS:
+            raise ValueError(f"Unknown focus metric {metric}, expected one of {set(METRICS)}.")
+
+        def score(zs):
+            return METRICS[metric](prepare(self.z_stack(zs), roi, downsample))
+
+        center = self.z
+        z, confidence = search(score, center - span / 2, center + span / 2, method, steps, tol)
+        self.z = z
+        self.wait()
+        return z, confidence
+
+    def apply(self, changes):
+        # Sets several devices at once, e.g. ctrl.apply({"filter": "GFP", "light": 50,
+        # "exposure": 100}). Devices in different groups are set concurrently, devices within a
+        # group one after another, and then every changed device gets waited on. Returns the
+        # seconds it took for each change to complete.
+        targets = {}
+        for name in changes:
+            if name in self._states:
+                targets[name] = self._devices[name]
+            elif name in ("exposure", "binning"):
+                targets[name] = self._camera
+            elif name == "z":
+                targets[name] = self._focus
+            elif name in ("x", "y", "xy"):
+                targets[name] = self._stage
+            else:
+                raise ValueError(f"Cannot apply changes to unknown setting {name}.")
+
+        devices = {}
+        for name, device in targets.items():
+            devices.setdefault(device.name, (device, []))[1].append(name)
+
+        start = time.perf_counter()
+        times = {}
+
+        def apply_group(device_names):
+            for device_name in device_names:
+                for name in devices[device_name][1]:
+                    setattr(self, name, changes[name])
+            for device_name in device_names:
+                device, names = devices[device_name]
+                self._wait_on(device)
+                for name in names:
+                    times[name] = time.perf_counter() - start
+
+        self._run_groups(devices, apply_group)
+        return {name: times[name] for name in changes}
+
+    def channel_stack(self, channels):
+        # Each channel maps state devices (and "exposure") to their values, e.g.
+        # [{"filter": "GFP", "exposure": 100}, {"filter": "RFP", "exposure": 200}]. Returns a
+        # (channel, y, x) stack like z_stack.
+        channels = list(channels)
+        keys = set(channels[0])
+        for channel in channels:
+            if set(channel) != keys:
+                raise ValueError("Every channel needs to set the same devices.")
+        unknown = keys - self._states - {"exposure"}
+        if unknown:
+            raise ValueError(f"Cannot switch unknown state devices {unknown} between channels.")
+
+        # Devices that stay the same in every channel only get set once.
+        varying = {
+            k: [c[k] for c in channels]
+            for k in keys
+            if any(c[k] != channels[0][k] for c in channels)
+        }
+        for k in keys:
+            setattr(self, k, channels[0][k])
+        self.wait()
+
+        camera = self._camera
+        exposures = varying.get("exposure", [camera.exposure] * len(channels))
+        sequences = [self._channel_sequence(k, values) for k, values in varying.items()]
+        if all(sequence is not None for sequence in sequences):
+            # Every device that changes between channels can be sequenced, so the camera's
+            # triggers step them through the channels and we only pay for a single sequence.
+            with contextlib.ExitStack() as running:
+                for sequence in sequences:
+                    running.enter_context(sequence)
+                frames = list(camera.stream(len(channels)))
+            # The sequences moved the devices without going through us.
+            self.refresh(*varying)
+            if len(frames) != len(channels):
+                raise RuntimeError(f"Expected {len(channels)} channels not {len(frames)}.")
+            # Whatever time between frames isn't spent exposing is spent switching.
+            self.switch_times = [
+                max(b.timestamp - a.timestamp - e / 1000, 0)
+                for a, b, e in zip(frames, frames[1:], exposures[1:], strict=False)
+            ]
+            return np.stack([frame.img for frame in frames])
+
+        stack = None
+        switch_times = []
+        for i, channel in enumerate(channels):
+            start = time.perf_counter()
+            if i > 0:
+                for k in varying:
+                    if channel[k] != channels[i - 1][k]:
+                        setattr(self, k, channel[k])
+                self.wait()
+                switch_times.append(time.perf_counter() - start)
+            img = camera.snap()
+            if stack is None:
+                stack = np.empty((len(channels), *img.shape), dtype=img.dtype)
+            stack[i] = img
+        self.switch_times = switch_times
+        return stack
+
+    def _channel_sequence(self, key, values):
+        # Returns None if the device behind key can't step through values on camera triggers.
+        if key == "exposure":
+            camera = self._camera
+            if dev.supports(camera, dev.ExposureSequence) and camera.exposure_sequenceable(
+                len(values)
+            ):
+                return camera.exposure_sequence(values)
+        else:
+            device = self._devices[key]
+            if dev.supports(device, dev.StateSequence) and device.state_sequenceable(len(values)):
+                return device.state_sequence(values)
+        return None
+
     @property
     def px_len(self):
-        zoom_total = 1
-        for device in self.devices:
-            if isinstance(device, dev.Zoom):
+        if self._px_len is None:
+            zoom_total = 1
+            for device in self._index[dev.Zoom]:
                 zoom_total *= device.zoom
-        return self._camera.px_len / zoom_total
+            self._px_len = self._camera.px_len / zoom_total
+        return self._px_len
+
+    @property
+    def binning(self):
+        return self._camera.binning
+
+    @binning.setter
+    def binning(self, new_binning):
+        self._touch(self._camera).binning = new_binning
+        self._px_len = None
 
     @property
     def exposure(self):
@@ -206,15 +451,15 @@ class Control:
 
     @exposure.setter
     def exposure(self, new_exposure):
-        self._camera.exposure = new_exposure
+        self._touch(self._camera).exposure = new_exposure
 
     @property
     def focus(self):
-        return self._focus
+        return self._hand_out(self._focus)
 
     @focus.setter
     def focus(self, new_focus):
-        self._focus = self.devices[new_focus]
+        self._focus = self._device(new_focus)
 
     @property
     def z(self):
@@ -222,15 +467,15 @@ class Control:
 
     @z.setter
     def z(self, new_z):
-        self._focus.z = new_z
+        self._touch(self._focus).z = new_z
 
     @property
     def stage(self):
-        return self._stage
+        return self._hand_out(self._stage)
 
     @stage.setter
     def stage(self, new_stage):
-        self._stage = self.devices[new_stage]
+        self._stage = self._device(new_stage)
 
     @property
     def x(self):
@@ -238,7 +483,7 @@ class Control:
 
     @x.setter
     def x(self, new_x):
-        self._stage.x = new_x
+        self._touch(self._stage).x = new_x
 
     @property
     def y(self):
@@ -246,7 +491,7 @@ class Control:
 
     @y.setter
     def y(self, new_y):
-        self._stage.y = new_y
+        self._touch(self._stage).y = new_y
 
     @property
     def xy(self):
@@ -254,25 +499,67 @@ class Control:
 
     @xy.setter
     def xy(self, new_xy):
-        self._stage.xy = new_xy
+        self._touch(self._stage).xy = new_xy
+
+    def _device(self, device):
+        # Devices can be given by name, by index into devices or as one of our devices.
+        if isinstance(device, str):
+            if device not in self._devices:
+                raise KeyError(f"Unknown device {device}.")
+            return self._devices[device]
+        if isinstance(device, int | np.integer) and not isinstance(device, bool):
+            return self.devices[device]
+        if any(device is d for d in self.devices):
+            return device
+        raise TypeError(f"Expected a device name, index or device, got {device!r}.")
 
     def __getattr__(self, name):
-        for device in self.devices:
-            if name == device.name:
-                if isinstance(device, dev.State):
-                    return device.state
-                else:
-                    return device
-        return self.__getattribute__(name)
+        # Go through __dict__ so a partially constructed Control can't recurse forever.
+        device = self.__dict__.get("_devices", {}).get(name)
+        if device is None:
+            return self.__getattribute__(name)
+        if name in self._states:
+            if self._cache_ttl is not None:
+                entry = self._cached(name)
+                if entry is not None:
+                    self._cache_hits[name] += 1
+                    return entry[0]
+                self._cache_misses[name] += 1
+            value = device.state
+            if self._cache_ttl is not None:
+                self._cache[name] = (value, time.monotonic(), value)
+            return value
+        # Whoever asked for the device itself might send it commands we don't see.
+        return self._hand_out(device)
 
     def __setattr__(self, name, value):
-        for device in self.devices:
-            if name == device.name and isinstance(device, dev.State):
-                device.state = value
-                return
+        if name[0] != "_" and name in self._states:
+            device = self._devices[name]
+            if self._cache_ttl is not None:
+                entry = self._cached(name)
+                if entry is not None and value in (entry[0], entry[2]):
+                    return
+            self._touch(device).state = value
+            if self._cache_ttl is not None:
+                # Cache what the device reports rather than what we set, e.g. filter = 1 reads
+                # back as a label. Remember what we set too so setting it again still gets skipped.
+                self._cache[name] = (device.state, time.monotonic(), value)
+            if name in self._zooms:
+                self._px_len = None
+            return
         super().__setattr__(name, value)
 
+    def _cached(self, name):
+        # Returns the (state, time, last set value) cached for name if it's still fresh.
+        entry = self._cache.get(name)
+        if entry is None or time.monotonic() - entry[1] > self._cache_ttl:
+            return None
+        return entry
+
     def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
         self._core.reset()
 
     def __enter__(self):
@@ -12,28 +12,84 @@ __all__ = [
     "ti",
     "ti2",
     "zyla",
+    "registry",
+    "register",
+    "PROTOCOLS",
     "Camera",
+    "ExposureSequence",
     "Focus",
     "Stage",
     "State",
+    "StateSequence",
     "Valved",
     "Wait",
     "Zoom",
+    "ZSequence",
+    "capabilities",
+    "supports",
 ]
 
-from . import (
-    asi,
-    bsi,
-    demo,
-    fluidic,
-    fluigent,
-    lumencor,
-    manual,
-    microfluidic,
-    sutter,
-    thor,
-    ti,
-    ti2,
-    zyla,
+import importlib
+from typing import TYPE_CHECKING
+
+from .protocols import (
+    PROTOCOLS,
+    Camera,
+    ExposureSequence,
+    Focus,
+    Stage,
+    State,
+    StateSequence,
+    Valved,
+    Wait,
+    Zoom,
+    ZSequence,
+    capabilities,
+    supports,
 )
-from .protocols import Camera, Focus, Stage, State, Valved, Wait, Zoom
+from .registry import register
+
+# Driver modules pull in things like pymodbus, pyserial and vendor DLLs so we only import them once
+# they're actually used.
+_SUBMODULES = {
+    "asi",
+    "bsi",
+    "demo",
+    "fluidic",
+    "fluigent",
+    "lumencor",
+    "manual",
+    "microfluidic",
+    "sutter",
+    "thor",
+    "ti",
+    "ti2",
+    "zyla",
+}
+
+if TYPE_CHECKING:
+    from . import (
+        asi,
+        bsi,
+        demo,
+        fluidic,
+        fluigent,
+        lumencor,
+        manual,
+        microfluidic,
+        sutter,
+        thor,
+        ti,
+        ti2,
+        zyla,
+    )
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,5 +1,7 @@
 import numpy as np
 
+from . import sequence
+
 
 class Stage:
     def __init__(self, name, core, port):
@@ -56,3 +58,9 @@ class Focus:
     @z.setter
     def z(self, new_z):
         self._core.setPosition(self.name, new_z)
+
+    def z_sequenceable(self, n):
+        return sequence.z_sequenceable(self._core, self.name, n)
+
+    def z_sequence(self, zs):
+        return sequence.z_sequence(self._core, self.name, zs)
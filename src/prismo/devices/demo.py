@@ -1,5 +1,7 @@
 import numpy as np
 
+from . import sequence
+
 
 class Camera:
     def __init__(self, name: str, core):
@@ -9,9 +11,10 @@ class Camera:
         core.initializeDevice(name)
 
     def snap(self) -> np.ndarray:
-        self._core.setCameraDevice(self.name)
-        self._core.snapImage()
-        return self._core.getImage()
+        return sequence.snap(self._core, self.name)
+
+    def stream(self, n: int | None = None):
+        return sequence.stream(self._core, self.name, n)
 
     def wait(self):
         self._core.waitForDevice(self.name)
@@ -24,6 +27,12 @@ class Camera:
     def exposure(self, new_exposure: float):
         self._core.setExposure(self.name, new_exposure)
 
+    def exposure_sequenceable(self, n: int) -> bool:
+        return sequence.exposure_sequenceable(self._core, self.name, n)
+
+    def exposure_sequence(self, exposures):
+        return sequence.exposure_sequence(self._core, self.name, exposures)
+
     @property
     def px_len(self) -> float:
         # TODO: Find out the pixel length of the demo camera.
@@ -65,6 +74,32 @@ class Stage:
         self._core.setXYPosition(self.name, new_xy[0], new_xy[1])
 
 
+class Focus:
+    def __init__(self, name: str, core):
+        self.name = name
+        self._core = core
+        core.loadDevice(name, "DemoCamera", "DStage")
+        core.initializeDevice(name)
+        core.setProperty(name, "UseSequences", "Yes")
+
+    def wait(self):
+        self._core.waitForDevice(self.name)
+
+    @property
+    def z(self) -> float:
+        return self._core.getPosition(self.name)
+
+    @z.setter
+    def z(self, new_z: float):
+        self._core.setPosition(self.name, new_z)
+
+    def z_sequenceable(self, n: int) -> bool:
+        return sequence.z_sequenceable(self._core, self.name, n)
+
+    def z_sequence(self, zs):
+        return sequence.z_sequence(self._core, self.name, zs)
+
+
 class Filter:
     def __init__(self, name: str, core, states=None):
         self.name = name
@@ -101,6 +136,12 @@ class Filter:
         else:
             self._core.setStateLabel(self.name, new_state)
 
+    def state_sequenceable(self, n: int) -> bool:
+        return sequence.property_sequenceable(self._core, self.name, "State", n)
+
+    def state_sequence(self, states):
+        return sequence.state_sequence(self._core, self.name, states)
+
 
 class Valves:
     def __init__(self, name, valves=None):
@@ -109,6 +150,14 @@ class Valves:
             valves = [i for i in range(48)]
         self.valves = {k: 1 for k in valves}
 
+    def snapshot(self, keys=None):
+        keys = self.valves.keys() if keys is None else keys
+        return {k: self.valves[k] for k in keys}
+
+    def set_many(self, values):
+        for k, v in values.items():
+            self[k] = v
+
     def __getitem__(self, key):
         return self.valves[key]
 
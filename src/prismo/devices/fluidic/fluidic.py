@@ -6,9 +6,10 @@ from dataclasses import dataclass
 from enum import IntEnum
 
 import numpy as np
-import packet
 import serial
 
+from . import packet
+
 
 class Code(IntEnum):
     INIT = 0x00
@@ -1,3 +1,4 @@
+import collections
 from collections.abc import Buffer
 
 import serial
@@ -5,10 +6,20 @@ from serial.tools import list_ports
 
 
 class PacketStream:
-    def __init__(self, timeout_s: int = 1):
+    def __init__(self, timeout_s: int = 1, url: str | None = None):
+        self._socket = None
+        self._buffer = bytearray()
+        self._packets = collections.deque()
+        if url is not None:
+            # Mostly useful for tests and benchmarks, e.g. url="loop://".
+            self._socket = serial.serial_for_url(url, baudrate=115200, timeout=timeout_s)
+            return
+
         for port in list_ports.comports():
             if port.manufacturer is not None and "Espressif" in port.manufacturer:
                 self._socket = serial.Serial(port.device, baudrate=115200, timeout=timeout_s)
+                self._buffer.clear()
+                self._packets.clear()
                 try:
                     self.write(bytes([0]))
                     result = self.read()
@@ -25,48 +36,58 @@ class PacketStream:
         data = memoryview(request).cast("B")
         if len(data) == 0:
             return
-        offset = 1
-        offset_idx = 0
-        out = bytearray([0])
-        for b in data:
-            if b != 0:
-                out.append(b)
-                offset += 1
-            elif b == 0 or offset == 255:
-                out.append(0)
-                out[offset_idx] = offset
-                offset = 1
-                offset_idx = len(out) - 1
+        self._socket.write(cobs_encode(data) + b"\x00")
 
-        if offset_idx != len(out) - 1 or data[-1] == 0:
-            out[offset_idx] = offset
-            out.append(0)
+    def read(self) -> bytes:
+        while not self._packets:
+            self._fill()
+        packet = self._packets.popleft()
+        if isinstance(packet, Exception):
+            raise packet
+        return packet
 
-        self._socket.write(out)
+    def _fill(self):
+        # Pull in everything that's already waiting with a single read instead of going byte by
+        # byte, blocking for at most one timeout if nothing has arrived yet.
+        data = self._socket.read(max(1, self._socket.in_waiting))
+        if len(data) == 0:
+            raise TimeoutError("Read timed out.")
 
-    def read(self) -> bytearray:
-        size = 0
-        while size == 0:
-            size = self._timeout_read(1)[0]
+        self._buffer += data
+        *frames, self._buffer = self._buffer.split(b"\x00")
+        for frame in frames:
+            if len(frame) == 0:
+                continue
+            # Keep malformed packets in the queue so they're reported in order and the packets
+            # that follow them aren't lost.
+            try:
+                self._packets.append(cobs_decode(frame))
+            except ValueError as e:
+                self._packets.append(e)
 
-        out = bytearray()
-        while size != 0:
-            buf = self._timeout_read(size - 1)
-            if any(b == 0 for b in buf):
-                while self._timeout_read(1)[0] != 0:
-                    pass
-                raise ValueError("Received unexpected zero byte in packet data.")
-            out.extend(buf)
-            size = self._timeout_read(1)[0]
-            if size == 0:
-                break
-            elif size != 255:
-                out.append(0)
 
-        return out
+def cobs_encode(data: Buffer) -> bytes:
+    out = bytearray()
+    for block in bytes(data).split(b"\x00"):
+        while len(block) >= 254:
+            out.append(255)
+            out += block[:254]
+            block = block[254:]
+        out.append(len(block) + 1)
+        out += block
+    return bytes(out)
 
-    def _timeout_read(self, size: int) -> bytearray:
-        out = self._socket.read(size)
-        if len(out) < size:
-            raise TimeoutError("Read timed out.")
-        return out
+
+def cobs_decode(data: Buffer) -> bytes:
+    data = bytes(data)
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        code = data[i]
+        if code == 0 or i + code > len(data):
+            raise ValueError("Received malformed packet.")
+        out += data[i + 1 : i + code]
+        i += code
+        if code != 255 and i < len(data):
+            out.append(0)
+    return bytes(out)
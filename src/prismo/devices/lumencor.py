@@ -1,3 +1,6 @@
+from . import sequence
+
+
 class Light:
     def __init__(self, name, core, port, version="sola"):
         self.name = name
@@ -17,3 +20,9 @@ class Light:
     @state.setter
     def state(self, new_state):
         self._core.setProperty(self.name, "White_Level", new_state)
+
+    def state_sequenceable(self, n):
+        return sequence.property_sequenceable(self._core, self.name, "White_Level", n)
+
+    def state_sequence(self, states):
+        return sequence.property_sequence(self._core, self.name, "White_Level", states)
@@ -13,16 +13,38 @@ class Valves:
 
     @property
     def valves(self):
-        return {v: self[v] for v in self._valves}
+        return self.snapshot()
+
+    def snapshot(self, keys=None):
+        # Read the whole bank of coils in a single request instead of one round trip per valve.
+        keys = self._valves if keys is None else keys
+        addrs = [self._addr(k) for k in keys]
+        bits = self._client.read_coils(512, count=max(addrs, default=-1) + 1).bits
+        return {k: 0 if bits[a] else 1 for k, a in zip(keys, addrs, strict=True)}
+
+    def set_many(self, values):
+        coils = sorted((self._addr(k), (v == "off") or (v == 0)) for k, v in values.items())
+        # Write each contiguous run of coils with a single request.
+        start = 0
+        for i in range(1, len(coils) + 1):
+            if i == len(coils) or coils[i][0] != coils[i - 1][0] + 1:
+                self._client.write_coils(coils[start][0], [c for _, c in coils[start:i]])
+                start = i
 
     def __getitem__(self, key):
-        addr = key if isinstance(key, int) else self._valves.index(key)
-        addr += 512
-        return 0 if self._client.read_coils(addr).bits[0] else 1
+        return self.snapshot([key])[key]
 
     def __setitem__(self, key, value):
-        addr = key if isinstance(key, int) else self._valves.index(key)
-        self._client.write_coil(addr, (value == "off") or (value == 0))
+        self._client.write_coil(self._addr(key), (value == "off") or (value == 0))
+
+    def _addr(self, key):
+        return key if isinstance(key, int) else self._valves.index(key)
+
+
+def close_then_open(valves, states):
+    # Close valves before opening any, otherwise the old and new branch can briefly be connected.
+    valves.set_many({k: v for k, v in states.items() if v == 1})
+    valves.set_many({k: v for k, v in states.items() if v != 1})
 
 
 class Mux:
@@ -41,11 +63,12 @@ class Mux:
 
     @property
     def input(self):
-        purge_state = 1 - self._valves[self._purge]
-        input_state = 1 - self._valves[self._input]
-        zeros_state = np.array([1 - self._valves[v] for v in self._zeros])
-        ones_state = np.array([1 - self._valves[v] for v in self._ones])
-        all_state = np.array([1 - self._valves[v] for v in self._all_inputs])
+        valves = self._valves.snapshot([self._purge, *self._all_inputs])
+        purge_state = 1 - valves[self._purge]
+        input_state = 1 - valves[self._input]
+        zeros_state = np.array([1 - valves[v] for v in self._zeros])
+        ones_state = np.array([1 - valves[v] for v in self._ones])
+        all_state = np.array([1 - valves[v] for v in self._all_inputs])
         if np.all(all_state) and not purge_state:
             return "open"
         elif not np.any(all_state) and not purge_state:
@@ -59,40 +82,42 @@ class Mux:
 
     @input.setter
     def input(self, new_state):
-        for v in self._all_inputs:
-            self._valves[v] = 1
-        self._valves[self._purge] = 1
+        # Work out the final state of every valve first so they switch in as few writes as possible.
+        valves = {v: 1 for v in self._all_inputs}
+        valves[self._purge] = 1
         if new_state == "open":
             for v in self._all_inputs:
-                self._valves[v] = 0
+                valves[v] = 0
         elif new_state == "closed":
             pass
         elif new_state == "purge":
             for v in self._zeros:
-                self._valves[v] = 0
+                valves[v] = 0
             for v in self._ones:
-                self._valves[v] = 0
-            self._valves[self._purge] = 0
+                valves[v] = 0
+            valves[self._purge] = 0
         elif isinstance(new_state, int):
             for i, b in enumerate(bin(new_state)[2:].zfill(len(self._ones))):
                 if b == "0":
-                    self._valves[self._zeros[i]] = 0
+                    valves[self._zeros[i]] = 0
                 else:
-                    self._valves[self._ones[i]] = 0
-            self._valves[self._input] = 0
+                    valves[self._ones[i]] = 0
+            valves[self._input] = 0
         elif "purge" in new_state:
             new_state = int(new_state.split("_")[1])
             for i, b in enumerate(bin(new_state)[2:].zfill(len(self._ones))):
                 if b == "0":
-                    self._valves[self._zeros[i]] = 0
+                    valves[self._zeros[i]] = 0
                 else:
-                    self._valves[self._ones[i]] = 0
-            self._valves[self._purge] = 0
+                    valves[self._ones[i]] = 0
+            valves[self._purge] = 0
+        close_then_open(self._valves, valves)
 
     @property
     def output(self):
-        waste_state = 1 - self._valves[self._waste]
-        flow_state = 1 - self._valves[self._flow]
+        valves = self._valves.snapshot([self._waste, self._flow])
+        waste_state = 1 - valves[self._waste]
+        flow_state = 1 - valves[self._flow]
         if waste_state and flow_state:
             return "open"
         elif waste_state:
@@ -104,15 +129,15 @@ class Mux:
 
     @output.setter
     def output(self, new_state):
-        self._valves[self._waste] = 1
-        self._valves[self._flow] = 1
+        valves = {self._waste: 1, self._flow: 1}
         if new_state == "waste":
-            self._valves[self._waste] = 0
+            valves[self._waste] = 0
         elif new_state == "flow":
-            self._valves[self._flow] = 0
+            valves[self._flow] = 0
         elif new_state == "open":
-            self._valves[self._flow] = 0
-            self._valves[self._waste] = 0
+            valves[self._flow] = 0
+            valves[self._waste] = 0
+        close_then_open(self._valves, valves)
 
 
 class MiniChip:
@@ -129,9 +154,10 @@ class MiniChip:
 
     @property
     def io(self):
-        zeros_state = np.array([1 - self._valves[v] for v in self._zeros])
-        ones_state = np.array([1 - self._valves[v] for v in self._ones])
-        all_state = np.array([1 - self._valves[v] for v in self._all_io])
+        valves = self._valves.snapshot(self._all_io)
+        zeros_state = np.array([1 - valves[v] for v in self._zeros])
+        ones_state = np.array([1 - valves[v] for v in self._ones])
+        all_state = np.array([1 - valves[v] for v in self._all_io])
         if np.all(all_state):
             return "open"
         elif not np.any(all_state):
@@ -144,20 +170,17 @@ class MiniChip:
     @io.setter
     def io(self, new_state):
         if new_state == "open":
-            for v in self._all_io:
-                self._valves[v] = 0
+            valves = {v: 0 for v in self._all_io}
         elif new_state == "closed":
-            for v in self._all_io:
-                self._valves[v] = 1
+            valves = {v: 1 for v in self._all_io}
         else:
-            for v in self._all_io:
-                self._valves[v] = 1
-
+            valves = {v: 1 for v in self._all_io}
             for i, b in enumerate(bin(new_state)[2:].zfill(len(self._ones))):
                 if b == "0":
-                    self._valves[self._zeros[i]] = 0
+                    valves[self._zeros[i]] = 0
                 else:
-                    self._valves[self._ones[i]] = 0
+                    valves[self._ones[i]] = 0
+        close_then_open(self._valves, valves)
 
     @property
     def btn(self):
@@ -221,4 +244,5 @@ class Chip:
 
     @property
     def valves(self):
-        return {k: self.__getattr__(k) == "closed" for k in self._mapping}
+        valves = self._valves.snapshot(list(self._mapping.values()))
+        return {k: bool(valves[v]) for k, v in self._mapping.items()}
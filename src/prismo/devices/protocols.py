@@ -1,3 +1,4 @@
+import inspect
 from typing import Protocol, runtime_checkable
 
 import numpy as np
@@ -40,3 +41,56 @@ class Wait(Protocol):
 @runtime_checkable
 class Zoom(Protocol):
     zoom: float
+
+
+@runtime_checkable
+class ExposureSequence(Protocol):
+    def exposure_sequenceable(self, n: int) -> bool: ...
+
+    def exposure_sequence(self, exposures): ...
+
+
+@runtime_checkable
+class StateSequence(Protocol):
+    def state_sequenceable(self, n: int) -> bool: ...
+
+    def state_sequence(self, states): ...
+
+
+@runtime_checkable
+class ZSequence(Protocol):
+    def z_sequenceable(self, n: int) -> bool: ...
+
+    def z_sequence(self, zs): ...
+
+
+PROTOCOLS = (
+    Camera,
+    ExposureSequence,
+    Focus,
+    Stage,
+    State,
+    StateSequence,
+    Valved,
+    Wait,
+    Zoom,
+    ZSequence,
+)
+
+
+def supports(device, protocol) -> bool:
+    # isinstance checks against runtime protocols call hasattr which evaluates properties, and
+    # for most devices that means talking to hardware. Looking members up statically doesn't.
+    members = set(protocol.__annotations__) | {
+        k for k, v in vars(protocol).items() if not k.startswith("_") and callable(v)
+    }
+    for member in members:
+        try:
+            inspect.getattr_static(device, member)
+        except AttributeError:
+            return False
+    return True
+
+
+def capabilities(device) -> frozenset[type]:
+    return frozenset(p for p in PROTOCOLS if supports(device, p))
@@ -0,0 +1,185 @@
+import importlib
+from dataclasses import dataclass, field
+from importlib.metadata import entry_points
+
+PORT_DEFAULTS = {
+    "AnswerTimeout": "500.0",
+    "BaudRate": "9600",
+    "DTR": "Disable",
+    "DataBits": "8",
+    "DelayBetweenCharsMs": "0.0",
+    "Fast USB to Serial": "Disable",
+    "Handshaking": "Off",
+    "Parity": "None",
+    "StopBits": "1",
+    "Verbose": "1",
+}
+
+
+@dataclass
+class Factory:
+    # Either the device class itself or a "module:attr" string that only gets imported once a
+    # config actually uses the device.
+    target: object
+    # Extra keyword arguments passed on to target, e.g. which filter wheel of a controller to use.
+    kwargs: dict = field(default_factory=dict)
+    # Whether target takes the Micro-Manager core after the device name.
+    core: bool = False
+    # Whether the params from the config get passed on to target.
+    params: bool = True
+    # Serial port settings (on top of PORT_DEFAULTS) for devices that talk over a port managed by
+    # Micro-Manager, the port's name comes from the device's "port" param.
+    port: dict | None = None
+    # Devices in the same group (e.g. sharing a hub or device adapter) get initialized one after
+    # another.
+    group: str | None = None
+    # Params that name another device, mapped to the device types that can fill them in by
+    # default when the config only has one device of those types.
+    refs: dict = field(default_factory=dict)
+
+    def create(self, name, core, params, refs):
+        target = self.target
+        if isinstance(target, str):
+            module, attr = target.split(":")
+            target = getattr(importlib.import_module(module), attr)
+        args = (name, core) if self.core else (name,)
+        params = params if self.params else {}
+        return target(*args, **self.kwargs, **params, **refs)
+
+
+FACTORIES = {}
+
+
+def register(device, target=None, **kwargs):
+    if target is None:
+        # register got called as a decorator.
+        def decorator(target):
+            FACTORIES[device] = Factory(target, **kwargs)
+            return target
+
+        return decorator
+    else:
+        # register got called as a standard function.
+        FACTORIES[device] = Factory(target, **kwargs)
+
+
+def factory(device):
+    if device not in FACTORIES:
+        # Other packages can provide devices through the "prismo.devices" entry point group, the
+        # entry point either loads a Factory or a device class that just takes a name and params.
+        for ep in entry_points(group="prismo.devices", name=device):
+            target = ep.load()
+            FACTORIES[device] = target if isinstance(target, Factory) else Factory(target)
+            break
+        else:
+            raise ValueError(f"Device {device} is not recognized.")
+    return FACTORIES[device]
+
+
+def plan(config):
+    # Work out everything load needs up front without touching any hardware: the factory and
+    # params of each device, the settings of each serial port, and which devices other devices
+    # refer to by name.
+    ports = {}
+    for name, params in config.items():
+        if "device" not in params:
+            continue
+        f = factory(params["device"])
+        if f.port is None:
+            continue
+        if "port" not in params:
+            raise ValueError(f"{name} requires a port to be specified.")
+        ports[params["port"]] = {**PORT_DEFAULTS, **f.port, **config.get(params["port"], {})}
+
+    specs = {}
+    for name, params in config.items():
+        if name in ports:
+            continue
+        if "device" not in params:
+            raise ValueError(f"{name} requires a device to be specified.")
+
+        params = dict(params)
+        f = factory(params.pop("device"))
+        refs = {}
+        for param, types in f.refs.items():
+            ref = params.pop(param, None)
+            if ref is None:
+                candidates = [n for n, p in config.items() if p.get("device") in types]
+                if len(candidates) != 1:
+                    raise ValueError(f"{name} requires {param} to be specified.")
+                ref = candidates[0]
+            if ref not in config or config[ref].get("device") not in types:
+                raise ValueError(f"{name} expected {param} to name one of {types} not {ref}.")
+            refs[param] = ref
+        specs[name] = (f, params, refs)
+
+    return ports, specs
+
+
+def _mm(target, group, **kwargs):
+    return Factory(f"prismo.devices.{target}", core=True, group=group, **kwargs)
+
+
+_ASI_PORT = {"AnswerTimeout": "2000.0"}
+_SUTTER_PORT = {"AnswerTimeout": "2000.0", "BaudRate": "128000"}
+_VALVES = ("demo_valves", "microfluidic_valves")
+
+FACTORIES.update(
+    {
+        "asi_stage": _mm("asi:Stage", "ASIStage", port=_ASI_PORT),
+        "asi_zstage": _mm("asi:Focus", "ASIStage", port=_ASI_PORT),
+        "bsi_camera": _mm("bsi:Camera", "PVCAM"),
+        "demo_camera": _mm("demo:Camera", "DemoCamera", params=False),
+        "demo_filter": _mm("demo:Filter", "DemoCamera"),
+        "demo_focus": _mm("demo:Focus", "DemoCamera", params=False),
+        "demo_stage": _mm("demo:Stage", "DemoCamera", params=False),
+        "demo_valves": Factory("prismo.devices.demo:Valves"),
+        "fluidic_sipper": Factory("prismo.devices.fluidic.fluidic:Sipper"),
+        "fluigent_flowcontroller": Factory(
+            "prismo.devices.fluigent:FlowController", group="fluigent"
+        ),
+        "lambda_filter1": _mm(
+            "sutter:Filter", "SutterLambda", kwargs=dict(filter="A"), port=_SUTTER_PORT
+        ),
+        "lambda_filter2": _mm(
+            "sutter:Filter", "SutterLambda", kwargs=dict(filter="B"), port=_SUTTER_PORT
+        ),
+        "lambda_filter3": _mm(
+            "sutter:Filter", "SutterLambda", kwargs=dict(filter="C"), port=_SUTTER_PORT
+        ),
+        "lambda_shutter1": _mm(
+            "sutter:Shutter", "SutterLambda", kwargs=dict(shutter="A"), port=_SUTTER_PORT
+        ),
+        "lambda_shutter2": _mm(
+            "sutter:Shutter", "SutterLambda", kwargs=dict(shutter="B"), port=_SUTTER_PORT
+        ),
+        "manual_objective": Factory("prismo.devices.manual:Objective"),
+        "microfluidic_chip": Factory("prismo.devices.microfluidic:Chip", refs={"valves": _VALVES}),
+        "microfluidic_minichip": Factory(
+            "prismo.devices.microfluidic:MiniChip", refs={"valves": _VALVES}
+        ),
+        "microfluidic_mux": Factory("prismo.devices.microfluidic:Mux", refs={"valves": _VALVES}),
+        "microfluidic_valves": Factory("prismo.devices.microfluidic:Valves"),
+        "sola_light": _mm(
+            "lumencor:Light", "LumencorSpectra", kwargs=dict(version="sola"), port={}
+        ),
+        "spectra_light": _mm(
+            "lumencor:Light", "LumencorSpectra", kwargs=dict(version="spectra"), port={}
+        ),
+        "thor_light": Factory("prismo.devices.thor:Light", group="thor"),
+        "ti_filter1": _mm("ti:Filter", "NikonTI", kwargs=dict(filter=1)),
+        "ti_filter2": _mm("ti:Filter", "NikonTI", kwargs=dict(filter=2)),
+        "ti_lightpath": _mm("ti:LightPath", "NikonTI"),
+        "ti_focus": _mm("ti:Focus", "NikonTI", params=False),
+        "ti_objective": _mm("ti:Objective", "NikonTI"),
+        "ti2_filter1": _mm("ti2:Filter", "NikonTi2", kwargs=dict(filter=1)),
+        "ti2_filter2": _mm("ti2:Filter", "NikonTi2", kwargs=dict(filter=2)),
+        "ti2_overheadlight": _mm("ti2:OverheadLight", "NikonTi2"),
+        "ti2_shutter1": _mm("ti2:Shutter", "NikonTi2", kwargs=dict(shutter=1), params=False),
+        "ti2_shutter2": _mm("ti2:Shutter", "NikonTi2", kwargs=dict(shutter=2), params=False),
+        "ti2_lightpath": _mm("ti2:LightPath", "NikonTi2"),
+        "ti2_focus": _mm("ti2:Focus", "NikonTi2", params=False),
+        "ti2_objective": _mm("ti2:Objective", "NikonTi2"),
+        "zyla_camera": _mm("zyla:Camera", "AndorSDK3"),
+    }
+)
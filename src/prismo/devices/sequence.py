@@ -0,0 +1,128 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+import pymmcore
+
+
+@dataclass
+class Frame:
+    img: np.ndarray
+    seq: int
+    timestamp: float
+    dropped: int
+
+
+def snap(core, camera):
+    if core.isSequenceRunning(camera):
+        # The core won't snap while the camera is streaming, e.g. with a live view open, so hand
+        # out the most recent streamed frame instead.
+        deadline = time.monotonic() + 1 + core.getExposure(camera) / 1000
+        while True:
+            try:
+                return core.getLastImage()
+            except RuntimeError:
+                # Nothing has made it into the buffer yet.
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.001)
+    core.setCameraDevice(camera)
+    core.snapImage()
+    return core.getImage()
+
+
+def stream(core, camera, n=None, transform=None):
+    if n is None:
+        # Continuous acquisitions can only run on the core's current camera.
+        core.setCameraDevice(camera)
+        core.startContinuousSequenceAcquisition(0)
+    else:
+        core.startSequenceAcquisition(camera, n, 0, False)
+
+    md = pymmcore.Metadata()
+    start = time.perf_counter()
+    count = 0
+    dropped = 0
+    last_seq = None
+    try:
+        while n is None or count < n:
+            if core.getRemainingImageCount() == 0:
+                if not core.isSequenceRunning(camera) and core.getRemainingImageCount() == 0:
+                    break
+                time.sleep(0.0005)
+                continue
+
+            img = core.popNextImageMD(md)
+            seq = int(_tag(md, "ImageNumber", count))
+            timestamp = float(_tag(md, "ElapsedTime-ms", 1000 * (time.perf_counter() - start)))
+            # The core clears its circular buffer when it overflows so gaps in the camera's image
+            # numbers are frames that we were too slow to pop.
+            if last_seq is not None and seq > last_seq + 1:
+                dropped += seq - last_seq - 1
+            last_seq = seq
+            count += 1
+
+            if transform is not None:
+                img = transform(img)
+            yield Frame(img, seq, timestamp / 1000, dropped)
+    finally:
+        core.stopSequenceAcquisition(camera)
+
+
+def z_sequenceable(core, stage, n):
+    return core.isStageSequenceable(stage) and core.getStageSequenceMaxLength(stage) >= n
+
+
+@contextmanager
+def z_sequence(core, stage, zs):
+    # The drive steps through zs on its own, advancing one position per camera trigger, so it
+    # has to be wired up to the camera's trigger output.
+    core.loadStageSequence(stage, [float(z) for z in zs])
+    core.startStageSequence(stage)
+    try:
+        yield
+    finally:
+        core.stopStageSequence(stage)
+
+
+def property_sequenceable(core, device, prop, n):
+    return core.isPropertySequenceable(device, prop) and (
+        core.getPropertySequenceMaxLength(device, prop) >= n
+    )
+
+
+@contextmanager
+def property_sequence(core, device, prop, values):
+    core.loadPropertySequence(device, prop, [str(v) for v in values])
+    core.startPropertySequence(device, prop)
+    try:
+        yield
+    finally:
+        core.stopPropertySequence(device, prop)
+
+
+def state_sequence(core, device, states):
+    # Only the numeric State property can be sequenced, not the Label property.
+    states = [core.getStateFromLabel(device, s) if isinstance(s, str) else s for s in states]
+    return property_sequence(core, device, "State", states)
+
+
+def exposure_sequenceable(core, camera, n):
+    return core.isExposureSequenceable(camera) and core.getExposureSequenceMaxLength(camera) >= n
+
+
+@contextmanager
+def exposure_sequence(core, camera, exposures):
+    core.loadExposureSequence(camera, [float(e) for e in exposures])
+    core.startExposureSequence(camera)
+    try:
+        yield
+    finally:
+        core.stopExposureSequence(camera)
+
+
+def _tag(md, key, default):
+    if not md.HasTag(key):
+        return default
+    return md.GetSingleTag(key).GetValue()
@@ -1,3 +1,6 @@
+from . import sequence
+
+
 class Filter:
     def __init__(self, name, core, filter, port, states=None):
         self.name = name
@@ -35,6 +38,12 @@ class Filter:
         else:
             self._core.setStateLabel(self.name, new_state)
 
+    def state_sequenceable(self, n):
+        return sequence.property_sequenceable(self._core, self.name, "State", n)
+
+    def state_sequence(self, states):
+        return sequence.state_sequence(self._core, self.name, states)
+
 
 class Shutter:
     def __init__(self, name, core, shutter, port):
@@ -62,3 +71,10 @@ class Shutter:
     @state.setter
     def state(self, new_state):
         self.open = new_state == "open"
+
+    def state_sequenceable(self, n):
+        return sequence.property_sequenceable(self._core, self.name, "State", n)
+
+    def state_sequence(self, states):
+        states = [int(s == "open") for s in states]
+        return sequence.property_sequence(self._core, self.name, "State", states)
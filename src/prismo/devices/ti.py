@@ -1,3 +1,6 @@
+from . import sequence
+
+
 class Filter:
     def __init__(self, name, core, filter, states=None):
         self.name = name
@@ -42,6 +45,12 @@ class Filter:
             self._core.setStateLabel(self.name, new_state)
             self._core.setStateLabel(self.name, new_state)
 
+    def state_sequenceable(self, n):
+        return sequence.property_sequenceable(self._core, self.name, "State", n)
+
+    def state_sequence(self, states):
+        return sequence.state_sequence(self._core, self.name, states)
+
 
 class LightPath:
     def __init__(self, name, core, states=None):
@@ -145,3 +154,9 @@ class Focus:
     @z.setter
     def z(self, new_z):
         self._core.setPosition(self.name, new_z)
+
+    def z_sequenceable(self, n):
+        return sequence.z_sequenceable(self._core, self.name, n)
+
+    def z_sequence(self, zs):
+        return sequence.z_sequence(self._core, self.name, zs)
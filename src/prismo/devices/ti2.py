@@ -1,3 +1,6 @@
+from . import sequence
+
+
 class Filter:
     def __init__(self, name, core, filter, states=None):
         self.name = name
@@ -38,6 +41,12 @@ class Filter:
         else:
             self._core.setStateLabel(self.name, new_state)
 
+    def state_sequenceable(self, n):
+        return sequence.property_sequenceable(self._core, self.name, "State", n)
+
+    def state_sequence(self, states):
+        return sequence.state_sequence(self._core, self.name, states)
+
 
 class LightPath:
     def __init__(self, name, core, states=None):
@@ -150,6 +159,13 @@ class Shutter:
     def state(self, new_state):
         self.open = new_state == "open"
 
+    def state_sequenceable(self, n):
+        return sequence.property_sequenceable(self._core, self.name, "State", n)
+
+    def state_sequence(self, states):
+        states = [int(s == "open") for s in states]
+        return sequence.property_sequence(self._core, self.name, "State", states)
+
 
 class OverheadLight:
     def __init__(self, name, core):
@@ -203,3 +219,9 @@ class Focus:
     @z.setter
     def z(self, new_z):
         self._core.setPosition(self.name, new_z)
+
+    def z_sequenceable(self, n):
+        return sequence.z_sequenceable(self._core, self.name, n)
+
+    def z_sequence(self, zs):
+        return sequence.z_sequence(self._core, self.name, zs)
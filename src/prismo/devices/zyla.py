@@ -1,5 +1,7 @@
 import numpy as np
 
+from . import sequence
+
 
 class Camera:
     def __init__(self, name, core, flip="none"):
@@ -10,16 +12,10 @@ class Camera:
         core.initializeDevice(name)
 
     def snap(self) -> np.ndarray:
-        self._core.setCameraDevice(self.name)
-        self._core.snapImage()
-        img = self._core.getImage()
-        if self._flip == "ud":
-            img = np.flipud(img)
-        elif self._flip == "lr":
-            img = np.fliplr(img)
-        elif self._flip == "both":
-            img = np.flipud(np.fliplr(img))
-        return img
+        return self._flip_img(sequence.snap(self._core, self.name))
+
+    def stream(self, n=None):
+        return sequence.stream(self._core, self.name, n, transform=self._flip_img)
 
     def wait(self):
         self._core.waitForDevice(self.name)
@@ -40,6 +36,21 @@ class Camera:
     def exposure(self, new_exposure: float):
         self._core.setExposure(self.name, new_exposure)
 
+    def exposure_sequenceable(self, n):
+        return sequence.exposure_sequenceable(self._core, self.name, n)
+
+    def exposure_sequence(self, exposures):
+        return sequence.exposure_sequence(self._core, self.name, exposures)
+
     @property
     def px_len(self) -> float:
         return self.binning * 6.5
+
+    def _flip_img(self, img):
+        if self._flip == "ud":
+            img = np.flipud(img)
+        elif self._flip == "lr":
+            img = np.fliplr(img)
+        elif self._flip == "both":
+            img = np.flipud(np.fliplr(img))
+        return img
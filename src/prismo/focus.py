@@ -0,0 +1,242 @@
+import numpy as np
+
+from . import paths
+
+METHODS = ("plane", "bilinear", "thin_plate")
+_MIN_ANCHORS = {"plane": 3, "bilinear": 4, "thin_plate": 3}
+
+
+class FocusMap:
+    def __init__(self, anchors=None, method="plane", focus=None, smoothing=0.0):
+        if method not in METHODS:
+            raise ValueError(f"Unknown focus map method {method}, expected one of {METHODS}.")
+        self.anchors = None if anchors is None else np.asarray(anchors, dtype=float).reshape(-1, 2)
+        self.method = method
+        # Called as focus(ctrl) at every anchor and returns the in focus z, by default that's
+        # software autofocus. Pass "current" to trust the current z instead, e.g. when a hardware
+        # focus lock keeps the sample in focus.
+        if not (focus is None or focus == "current" or callable(focus)):
+            raise ValueError(f"Unknown focus {focus}, expected a callable or 'current'.")
+        self.focus = focus
+        self.smoothing = smoothing
+        self.zs = None
+        self._coefs = None
+
+    def measure(self, ctrl):
+        if self.anchors is None:
+            raise ValueError("Focus map anchors need to be set before measuring.")
+        zs = np.empty(len(self.anchors))
+        for i in paths.position_path(self.anchors, "tsp", start=ctrl.xy):
+            ctrl.xy = self.anchors[i]
+            ctrl.wait()
+            if self.focus is None:
+                zs[i] = ctrl.autofocus()[0]
+            elif self.focus == "current":
+                zs[i] = ctrl.z
+            else:
+                zs[i] = self.focus(ctrl)
+        self.fit(zs)
+        return self
+
+    def fit(self, zs):
+        zs = np.asarray(zs, dtype=float)
+        if len(zs) < _MIN_ANCHORS[self.method]:
+            raise ValueError(
+                f"A {self.method} focus map needs at least {_MIN_ANCHORS[self.method]} anchors."
+            )
+        self.zs = zs
+        # Fit in normalized coordinates, stage positions in um make x * y and r^2 log(r)
+        # terms badly conditioned otherwise.
+        self._origin = self.anchors.mean(axis=0)
+        self._scale = max(float(np.abs(self.anchors - self._origin).max()), 1e-9)
+        xy = (self.anchors - self._origin) / self._scale
+        if self.method == "thin_plate":
+            n = len(xy)
+            p = np.column_stack([np.ones(n), xy])
+            a = np.zeros((n + 3, n + 3))
+            a[:n, :n] = _tps_kernel(xy[:, None] - xy[None]) + self.smoothing * np.eye(n)
+            a[:n, n:] = p
+            a[n:, :n] = p.T
+            b = np.concatenate([zs, np.zeros(3)])
+        else:
+            a = self._terms(xy)
+            b = zs
+        # lstsq instead of solve so collinear anchors (e.g. a single row of tiles) still fit.
+        self._coefs = np.linalg.lstsq(a, b, rcond=None)[0]
+
+    @property
+    def fitted(self):
+        return self._coefs is not None
+
+    def __call__(self, x, y):
+        if not self.fitted:
+            raise ValueError("Focus map needs to be measured or fit before use.")
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        xy = (np.stack([x.ravel(), y.ravel()], axis=1) - self._origin) / self._scale
+        if self.method == "thin_plate":
+            n = len(self.anchors)
+            anchors = (self.anchors - self._origin) / self._scale
+            k = _tps_kernel(xy[:, None] - anchors[None])
+            z = k @ self._coefs[:n] + np.column_stack([np.ones(len(xy)), xy]) @ self._coefs[n:]
+        else:
+            z = self._terms(xy) @ self._coefs
+        z = z.reshape(x.shape)
+        return float(z) if z.ndim == 0 else z
+
+    def _terms(self, xy):
+        x, y = xy[:, 0], xy[:, 1]
+        terms = [np.ones_like(x), x, y]
+        if self.method == "bilinear":
+            terms.append(x * y)
+        return np.column_stack(terms)
+
+    @property
+    def attrs(self):
+        return dict(
+            method=self.method,
+            anchors=None if self.anchors is None else self.anchors.tolist(),
+            zs=None if self.zs is None else self.zs.tolist(),
+            smoothing=self.smoothing,
+        )
+
+    @classmethod
+    def from_attrs(cls, attrs, focus=None):
+        fmap = cls(attrs["anchors"], attrs["method"], focus, attrs["smoothing"])
+        if attrs["zs"] is not None:
+            fmap.fit(attrs["zs"])
+        return fmap
+
+
+def grid_anchors(xs, ys, n=3):
+    # An n x n grid of tile positions spread evenly over the tiles from tile_coords.
+    xs = np.asarray(xs)[np.unique(np.linspace(0, len(xs) - 1, n).round().astype(int))]
+    ys = np.asarray(ys)[np.unique(np.linspace(0, len(ys) - 1, n).round().astype(int))]
+    return np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+
+
+def position_anchors(xys, n=9):
+    # Pick n positions that are as far apart from each other as possible.
+    xys = np.asarray(xys, dtype=float).reshape(-1, 2)
+    if len(xys) <= n:
+        return xys
+    picked = [int(np.argmin(xys.sum(axis=1)))]
+    d = np.linalg.norm(xys - xys[picked[0]], axis=1)
+    for _ in range(n - 1):
+        picked.append(int(np.argmax(d)))
+        d = np.minimum(d, np.linalg.norm(xys - xys[picked[-1]], axis=1))
+    return xys[picked]
+
+
+def _tps_kernel(diff):
+    r2 = (diff**2).sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(r2 > 0, 0.5 * r2 * np.log(r2), 0.0)
+
+
+def normalized_variance(imgs):
+    mean = imgs.mean(axis=(-2, -1))
+    return imgs.var(axis=(-2, -1)) / np.maximum(mean, 1e-12)
+
+
+def brenner(imgs):
+    dx = imgs[..., 2:] - imgs[..., :-2]
+    return (dx**2).mean(axis=(-2, -1))
+
+
+def laplacian(imgs):
+    lap = (
+        4 * imgs[..., 1:-1, 1:-1]
+        - imgs[..., :-2, 1:-1]
+        - imgs[..., 2:, 1:-1]
+        - imgs[..., 1:-1, :-2]
+        - imgs[..., 1:-1, 2:]
+    )
+    return (lap**2).mean(axis=(-2, -1))
+
+
+# Every metric scores a whole (z, y, x) stack at once, higher is sharper.
+METRICS = {"normalized_variance": normalized_variance, "brenner": brenner, "laplacian": laplacian}
+SEARCHES = ("coarse_to_fine", "golden", "sweep")
+
+
+def prepare(imgs, roi=None, downsample=1):
+    # Crop imgs to roi=(y0, y1, x0, x1) and average downsample x downsample blocks so metrics
+    # only look at as many pixels as they need to.
+    imgs = np.asarray(imgs)
+    if roi is not None:
+        y0, y1, x0, x1 = roi
+        imgs = imgs[..., y0:y1, x0:x1]
+    if downsample > 1:
+        h = imgs.shape[-2] // downsample
+        w = imgs.shape[-1] // downsample
+        imgs = imgs[..., : h * downsample, : w * downsample].reshape(
+            *imgs.shape[:-2], h, downsample, w, downsample
+        )
+        return imgs.mean(axis=(-3, -1), dtype=np.float32)
+    return imgs.astype(np.float32)
+
+
+def search(score, lo, hi, method="coarse_to_fine", steps=9, tol=0.5):
+    # Finds the z in [lo, hi] that maximizes score, which takes an array of zs and returns an
+    # array of scores. Returns the best z and a confidence between 0 and 1.
+    if method not in SEARCHES:
+        raise ValueError(f"Unknown focus search {method}, expected one of {SEARCHES}.")
+    if steps < 3:
+        raise ValueError(f"Focus searches need at least 3 steps, got {steps}.")
+    if tol <= 0:
+        raise ValueError(f"Focus search tolerance has to be positive, got {tol}.")
+    scores = []
+
+    def record(zs):
+        new_scores = np.asarray(score(zs), dtype=float)
+        scores.extend(new_scores)
+        return new_scores
+
+    if method == "golden":
+        ratio = (np.sqrt(5) - 1) / 2
+        a, b = lo, hi
+        c, d = b - ratio * (b - a), a + ratio * (b - a)
+        fc, fd = record([c])[0], record([d])[0]
+        while b - a > tol:
+            if fc > fd:
+                b, d, fd = d, c, fc
+                c = b - ratio * (b - a)
+                fc = record([c])[0]
+            else:
+                a, c, fc = c, d, fd
+                d = a + ratio * (b - a)
+                fd = record([d])[0]
+        best = (a + b) / 2
+        at_edge = best - lo < tol or hi - best < tol
+    else:
+        a, b = lo, hi
+        first = True
+        while True:
+            level = np.linspace(a, b, steps)
+            level_scores = record(level)
+            i = int(np.argmax(level_scores))
+            if first:
+                at_edge = i in (0, steps - 1)
+                first = False
+            best = _parabolic(level, level_scores, i)
+            step = level[1] - level[0]
+            if method == "sweep" or step <= tol:
+                break
+            a, b = level[max(i - 1, 0)], level[min(i + 1, steps - 1)]
+
+    scores = np.asarray(scores)
+    # A sharp peak relative to the background means we probably found focus, a peak at the edge
+    # of the range means the actual focus is likely outside of it.
+    confidence = 0.0 if at_edge else float((scores.max() - scores.min()) / max(scores.max(), 1e-12))
+    return float(best), confidence
+
+
+def _parabolic(zs, scores, i):
+    # Refine the best z by fitting a parabola through it and its neighbors.
+    if i == 0 or i == len(zs) - 1:
+        return zs[i]
+    s0, s1, s2 = scores[i - 1], scores[i], scores[i + 1]
+    denom = s0 - 2 * s1 + s2
+    if denom >= 0:
+        return zs[i]
+    return zs[i] + 0.5 * (zs[i + 1] - zs[i]) * (s0 - s2) / denom
@@ -1,37 +1,219 @@
+import collections
+import contextlib
+import itertools
+import pickle
 import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import dask.array as da
 import dill
 import multiprocess
-import napari
 import numpy as np
 import xarray as xr
 import zarr as zr
-from qtpy.QtCore import QTimer
+from multiprocess import shared_memory
 from zarr.errors import ContainsGroupError
 
-from .widgets import BoundarySelector, PositionSelector, init_widgets
+from . import focus, paths
+from .writer import ShardBuffer, Writer, compressor
 
 
 class Relay:
     def __init__(self, pipe, path=""):
         self._path = path
-        self._pipe = pipe
+        self._conn = pipe if isinstance(pipe, RelayConnection) else RelayConnection(pipe)
 
     def subpath(self, path):
-        return Relay(self._pipe, self._path + path + "/")
+        return Relay(self._conn, self._path + path + "/")
 
     def get(self, route, *args, **kwargs):
-        self._pipe.send([self._path + route, args, kwargs])
-        return self._pipe.recv()
+        return self.get_async(route, *args, **kwargs).result()
+
+    def get_async(self, route, *args, **kwargs):
+        return self._conn.request(self._path + route, args, kwargs)
 
     def post(self, route, *args, **kwargs):
-        self._pipe.send([self._path + route, args, kwargs])
+        self._conn.request(self._path + route, args, kwargs, reply=False)
+
+    def subscribe(self, topic, callback):
+        self._conn.subscribe(self._path + topic, callback)
+
+    def unsubscribe(self, topic, callback=None):
+        self._conn.unsubscribe(self._path + topic, callback)
+
+
+class RelayConnection:
+    def __init__(self, pipe):
+        self._pipe = pipe
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {}
+        self._subscribers = {}
+        self._events = {}
+        # Events arrive on the receiver thread, the signal hands them over to the Qt event loop.
+        # Relay connections only live in the viewer process so that's the only one importing Qt.
+        from .widgets import RelaySignal
+
+        self._signal = RelaySignal()
+        self._signal.event.connect(self._deliver)
+        self._receiver = threading.Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+
+    def request(self, route, args, kwargs, reply=True):
+        # Every request gets tagged with an id so replies can come back in any order, a slow route
+        # then only holds up whoever is waiting on it.
+        future = None
+        req_id = None
+        with self._lock:
+            if reply:
+                future = Future()
+                req_id = next(self._ids)
+                self._pending[req_id] = future
+            self._pipe.send([req_id, route, args, kwargs])
+        return future
+
+    def subscribe(self, topic, callback):
+        with self._lock:
+            first = topic not in self._subscribers
+            self._subscribers.setdefault(topic, []).append(callback)
+        if first:
+            self.request("subscribe", (topic,), {}, reply=False)
+
+    def unsubscribe(self, topic, callback=None):
+        with self._lock:
+            callbacks = self._subscribers.get(topic, [])
+            if callback is None:
+                callbacks.clear()
+            elif callback in callbacks:
+                callbacks.remove(callback)
+            last = topic in self._subscribers and not callbacks
+            if last:
+                del self._subscribers[topic]
+        if last:
+            self.request("unsubscribe", (topic,), {}, reply=False)
+
+    def _receive(self):
+        while True:
+            try:
+                req_id, ok, value = self._pipe.recv()
+            except (EOFError, OSError):
+                break
+            if req_id is None:
+                # Published events carry their topic in place of the ok flag. Only the latest value
+                # of each topic is kept so a busy event loop skips stale events instead of
+                # queueing them up.
+                with self._lock:
+                    queued = ok in self._events
+                    self._events[ok] = value
+                if not queued:
+                    self._signal.event.emit(ok)
+                continue
+            with self._lock:
+                future = self._pending.pop(req_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending = {}
+        for future in pending:
+            future.set_exception(ConnectionError("Lost the connection to the router."))
+
+    def _deliver(self, topic):
+        with self._lock:
+            value = self._events.pop(topic)
+            callbacks = list(self._subscribers.get(topic, []))
+        for callback in callbacks:
+            callback(value)
+
+
+# Seconds before a device route gives up and replies with a TimeoutError.
+ROUTE_TIMEOUT = 5.0
+
+
+class FrameBuffer:
+    def __init__(self, shape, dtype, slots=4, name=None):
+        dtype = np.dtype(dtype)
+        # Every slot gets the sequence number of the frame in it followed by the frames.
+        size = slots * 8 + slots * int(np.prod(shape)) * dtype.itemsize
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            # The viewer process is spawned from this process so it shares our resource tracker
+            # and attaching won't cause the segment to be unlinked when the viewer exits.
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        self._seqs = np.ndarray((slots,), dtype=np.int64, buffer=self._shm.buf)
+        self._frames = np.ndarray(
+            (slots,) + tuple(shape), dtype=dtype, buffer=self._shm.buf, offset=slots * 8
+        )
+        self._slots = slots
+        self._latest = (0, 0)
+
+    @property
+    def spec(self):
+        return dict(
+            shape=self._frames.shape[1:],
+            dtype=self._frames.dtype.str,
+            slots=self._slots,
+            name=self._shm.name,
+        )
+
+    @property
+    def latest(self):
+        return self._latest
+
+    def put(self, img):
+        slot, seq = self._latest
+        slot = (slot + 1) % self._slots
+        self._seqs[slot] = -1
+        self._frames[slot] = img
+        self._seqs[slot] = seq + 1
+        self._latest = (slot, seq + 1)
+
+    def read(self, slot, seq):
+        # Returns a copy of frame seq, or None if the slot got overwritten before or while we
+        # copied it. Readers can't keep a view since slots get reused at the camera's frame rate.
+        if self._seqs[slot] != seq:
+            return None
+        img = self._frames[slot].copy()
+        return img if self._seqs[slot] == seq else None
+
+    def unlink(self):
+        # Existing mappings stay valid after unlinking so this is safe to call while a worker is
+        # still writing frames, the memory is released once every process drops its buffer.
+        self._shm.unlink()
+
+
+def route_key(name):
+    # widget/valves/set_valve and widget/valves/valves both belong to widget/valves.
+    return name.rsplit("/", 1)[0] if "/" in name else name
 
 
 class GUI:
-    def __init__(self, init_client, file=None, tile=None, attrs=None):
+    def __init__(
+        self,
+        init_client,
+        file=None,
+        tile=None,
+        attrs=None,
+        write_budget=1 << 30,
+        write_policy="block",
+        metadata_interval=1.0,
+        codec="balanced",
+        write_threads=4,
+        route_threads=8,
+        headless=False,
+    ):
         def run_gui(pipe):
+            import napari
+
             viewer = napari.Viewer()
             relay = Relay(pipe)
             # Save the client in a variable so it doesn't get garbage collected.
@@ -40,39 +222,78 @@ class GUI:
             pipe.close()
 
         def run_router(pipe, quit):
-            while not quit.is_set():
-                try:
-                    route, args, kwargs = pipe.recv()
-                    result = self._routes[route](*args, **kwargs)
-                    if result is not None:
-                        pipe.send(result)
-                except (BrokenPipeError, EOFError):
-                    self.quit()
-                except Exception as e:
-                    self.quit()
-                    raise e
+            # Routes run on a thread pool so a slow device only stalls the requests that use it.
+            pool = ThreadPoolExecutor(self._route_threads, thread_name_prefix="prismo-route")
+            try:
+                while not quit.is_set():
+                    try:
+                        req_id, route, args, kwargs = pipe.recv()
+                    except (BrokenPipeError, EOFError, OSError):
+                        self.quit()
+                        break
+                    self._dispatch(pool, req_id, route, args, kwargs)
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
 
         self._running = threading.Event()
         self._running.set()
         self._quit = threading.Event()
-        ctx = multiprocess.get_context("spawn")
-        self._pipe, child_pipe = ctx.Pipe()
-        self._gui_process = ctx.Process(target=run_gui, args=(child_pipe,))
+        self._headless = headless
+        self._pipe = None
+        self._gui_process = None
+        self._router = None
+        if not headless:
+            ctx = multiprocess.get_context("spawn")
+            self._pipe, child_pipe = ctx.Pipe()
+            self._gui_process = ctx.Process(target=run_gui, args=(child_pipe,))
+            self._router = threading.Thread(target=run_router, args=(self._pipe, self._quit))
         self._workers = []
-        self._router = threading.Thread(target=run_router, args=(self._pipe, self._quit))
         self._routes = {}
+        self._route_threads = route_threads
+        # Routes and watchers that share a path prefix, e.g. widget/valves, talk to the same device
+        # so they run one at a time.
+        self._route_locks = {}
+        # Prefixes with a call that timed out but hasn't returned yet.
+        self._stuck = collections.Counter()
+        self._stuck_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._subscriptions = set()
+        self._watchers = []
+        self._frame_buffers = []
         self._arrays = {}
         self._array_lock = threading.Lock()
         self._file = file
         self._tile = tile
         self._attrs = attrs if attrs is not None else {}
+        self._writer = None
+        self._shard_buffers = []
+        self._write_budget = write_budget
+        self._write_policy = write_policy
+        self._write_threads = write_threads
+        self._codec = codec
+        self._codecs = {}
+        self._metadata = {}
+        self._metadata_interval = metadata_interval
+        self._metadata_time = time.monotonic()
 
     def start(self):
+        if self._headless:
+            # Nothing can subscribe to anything without a viewer so watchers aren't needed either.
+            for worker in self._workers:
+                worker.start()
+            return
+
         self._gui_process.start()
         for worker in self._workers:
             worker.start()
+        for watcher in self._watchers:
+            watcher.start()
         self._router.start()
 
+    def join(self, timeout=None):
+        for worker in self._workers:
+            worker.join(timeout)
+
     def resume(self):
         self._running.set()
 
@@ -82,9 +303,28 @@ class GUI:
     def quit(self):
         self._running.set()
         self._quit.set()
-        if self._gui_process.is_alive():
-            self._gui_process.terminate()
-        self._pipe.close()
+        try:
+            # Workers stop at their next yield, let them finish the current step (and flush in
+            # their finally) before the writer goes away.
+            for worker in self._workers:
+                if worker.ident is not None and worker is not threading.current_thread():
+                    worker.join()
+            if self._writer is not None:
+                # Buffered and queued tiles still land on disk before the writer threads and
+                # any spill files go away.
+                try:
+                    self.flush()
+                finally:
+                    self._writer.close()
+                    self._writer = None
+        finally:
+            if self._gui_process is not None and self._gui_process.is_alive():
+                self._gui_process.terminate()
+            if self._pipe is not None:
+                self._pipe.close()
+            for frames in self._frame_buffers:
+                frames.unlink()
+            self._frame_buffers = []
 
     def worker(self, func):
         def run_worker():
@@ -97,24 +337,159 @@ class GUI:
 
         return func
 
-    def route(self, name, func=None):
+    def route(self, name, func=None, timeout=None):
         if func is None:
             # route got called as a decorator.
             def decorator(func):
-                self._routes[name] = func
+                self._routes[name] = (func, timeout)
                 return func
 
             return decorator
         else:
             # route got called as a standard method.
-            self._routes[name] = func
-
-    def array(self, name, **dims):
+            self._routes[name] = (func, timeout)
+
+    def publish(self, topic, value=None):
+        # Only push to the viewer when something over there is listening, idle topics cost nothing.
+        if topic in self._subscriptions:
+            self._send(None, topic, value)
+
+    def watch(self, topic, getter, interval=0.1):
+        # Poll state that has no change notifications of its own, e.g. valves or the stage
+        # position. Only polls while the topic has subscribers and only publishes changes.
+        key = route_key(topic)
+        lock = self._route_locks.setdefault(key, threading.Lock())
+
+        def run_watcher():
+            last = None
+            while not self._quit.wait(interval):
+                if topic not in self._subscriptions or self._stuck[key]:
+                    last = None
+                    continue
+                try:
+                    with lock:
+                        value = getter()
+                except Exception:
+                    traceback.print_exc()
+                    continue
+                fingerprint = pickle.dumps(value)
+                if fingerprint != last:
+                    last = fingerprint
+                    self.publish(topic, value)
+
+        self._watchers.append(threading.Thread(target=run_watcher, daemon=True))
+
+    def _dispatch(self, pool, req_id, route, args, kwargs):
+        # Subscriptions are handled right away so they're applied in the order they were sent.
+        if route == "subscribe":
+            self._subscriptions.add(*args)
+            return
+        if route == "unsubscribe":
+            self._subscriptions.discard(*args)
+            return
+
+        once = threading.Lock()
+
+        def reply(ok, value):
+            # Whichever of the route finishing or its timeout expiring happens first gets to reply.
+            if not once.acquire(blocking=False):
+                return
+            if req_id is not None:
+                self._send(req_id, ok, value)
+            elif not ok:
+                # Nobody is waiting on a post so report its errors here.
+                traceback.print_exception(value)
+
+        def done(future):
+            if future.cancelled():
+                reply(False, ConnectionError(f"Route {route} was cancelled."))
+            elif future.exception() is not None:
+                reply(False, future.exception())
+            else:
+                reply(True, future.result())
+
+        if route not in self._routes:
+            reply(False, KeyError(f"Unknown route {route}."))
+            return
+        func, timeout = self._routes[route]
+        key = route_key(route)
+        if self._stuck[key]:
+            # Don't tie up another pool thread on a device that still hasn't answered.
+            reply(False, TimeoutError(f"Route {route} is waiting on an earlier call to {key}."))
+            return
+        lock = self._route_locks.setdefault(key, threading.Lock())
+
+        def run():
+            with lock:
+                return func(*args, **kwargs)
+
+        future = pool.submit(run)
+        if timeout is not None:
+            timed_out = [False]
+
+            def expire():
+                with self._stuck_lock:
+                    if future.done():
+                        return
+                    timed_out[0] = True
+                    self._stuck[key] += 1
+                reply(False, TimeoutError(f"Route {route} took longer than {timeout}s."))
+
+            def finish(_):
+                timer.cancel()
+                with self._stuck_lock:
+                    if timed_out[0]:
+                        self._stuck[key] -= 1
+
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+            future.add_done_callback(finish)
+        future.add_done_callback(done)
+
+    def _send(self, req_id, ok, value):
+        with self._send_lock:
+            try:
+                self._pipe.send((req_id, ok, value))
+            except (BrokenPipeError, OSError):
+                pass
+            except Exception as e:
+                if req_id is None:
+                    raise
+                # The result or error couldn't be pickled.
+                self._pipe.send((req_id, False, RuntimeError(repr(e))))
+
+    def frame_buffer(self, img, slots=4):
+        # Frames are shared with the viewer through shared memory so the pipe only needs to carry
+        # the slot and sequence number of the latest frame.
+        frames = FrameBuffer(img.shape, img.dtype, slots)
+        frames.put(img)
+        self._frame_buffers.append(frames)
+        self.route("frames", lambda: frames.spec)
+        self.route("img", lambda: frames.latest)
+        return frames
+
+    def array(self, name, shards=None, codec=None, **dims):
         shape = tuple(x if isinstance(x, int) else len(x) for x in dims.values())
+        chunks = (1,) * len(dims) + self._tile.shape
+        encoding = {}
+        if shards is not None:
+            unknown = set(shards) - set(dims)
+            if unknown:
+                raise ValueError(f"Cannot shard {name} along unknown dimensions {unknown}.")
+            # Pack several tiles into each shard file along the non-spatial dimensions.
+            encoding["chunks"] = chunks
+            encoding["shards"] = (
+                tuple(min(shards.get(d, 1), n) for d, n in zip(dims, shape, strict=True))
+                + self._tile.shape
+            )
+            # Xarray requires dask chunks to line up with shard boundaries.
+            chunks = encoding["shards"]
+
         xp = xr.DataArray(
             data=da.zeros(
                 shape=shape + self._tile.shape,
-                chunks=(1,) * len(dims) + self._tile.shape,
+                chunks=chunks,
                 dtype=self._tile.dtype,
             ),
             dims=tuple(dims.keys()) + ("y", "x"),
@@ -126,16 +501,18 @@ class GUI:
                 xp.coords[dim_name] = coords
 
         store = zr.storage.LocalStore(self._file)
-        compressor = zr.codecs.BloscCodec(
-            cname="zstd", clevel=5, shuffle=zr.codecs.BloscShuffle.bitshuffle
-        )
+        codec = self._codec if codec is None else codec
+        encoding["compressors"] = compressor(codec)
 
         for attr_name, attr in self._attrs.items():
             xp.attrs[attr_name] = attr
 
         try:
             xp.to_dataset(promote_attrs=True, name="tile").to_zarr(
-                store, group=name, compute=False, encoding={"tile": {"compressors": compressor}}
+                store,
+                group=name,
+                compute=False,
+                encoding={"tile": encoding},
             )
         except ContainsGroupError as e:
             raise FileExistsError(f"{self._file}/{name} already exists.") from e
@@ -150,10 +527,88 @@ class GUI:
         xp.data = tiles
 
         with self._array_lock:
+            if self._writer is None:
+                self._writer = Writer(
+                    self._write_budget,
+                    self._write_policy,
+                    self._write_threads,
+                    callback=lambda _: self.publish("written"),
+                )
+            tiles._writer = self._writer
+            tiles._shards = None
+            if shards is not None:
+                tiles._shards = ShardBuffer(zarr_tiles, self._writer)
+                self._shard_buffers.append(tiles._shards)
             self._arrays[name] = xp
+            self._codecs[name] = (codec, zarr_tiles.nbytes_stored())
+            self._metadata[name] = metadata_fingerprint(xp)
+            arrays = set(self._arrays)
 
+        self.publish("arrays", arrays)
         return xp
 
+    def set_attr(self, name, value):
+        # Arrays created later on pick the attr up too, sync_metadata writes it to disk.
+        self._attrs[name] = value
+        for xp in self.arrays.values():
+            xp.attrs[name] = value
+
+    def sync_metadata(self, force=False):
+        # Only rewrite the zarr metadata of arrays whose attrs or coords changed since we last
+        # wrote them, and at most once per metadata_interval unless forced.
+        now = time.monotonic()
+        if not force and now - self._metadata_time < self._metadata_interval:
+            return
+        self._metadata_time = now
+
+        with self._array_lock:
+            shard_buffers = list(self._shard_buffers)
+        for shards in shard_buffers:
+            # Shards that stopped filling up, e.g. because they span time points, still show up
+            # in the viewer after a while.
+            shards.flush(older_than=self._metadata_interval)
+
+        store = None
+        for name, xp in self.arrays.items():
+            fingerprint = metadata_fingerprint(xp)
+            if fingerprint == self._metadata.get(name):
+                continue
+            if store is None:
+                store = zr.storage.LocalStore(self._file)
+            # No pixel data gets written since compute=False, so dask chunks not lining up with
+            # the shards of sharded arrays doesn't matter here.
+            xp.to_dataset(promote_attrs=True, name="tile").to_zarr(
+                store, group=name, compute=False, mode="a", safe_chunks=False
+            )
+            self._metadata[name] = fingerprint
+
+    def flush(self):
+        with self._array_lock:
+            shard_buffers = list(self._shard_buffers)
+        for shards in shard_buffers:
+            shards.flush()
+        if self._writer is not None:
+            self._writer.flush()
+            for name, xp in self.arrays.items():
+                codec, metadata_bytes = self._codecs[name]
+                nbytes, seconds, dropped, busy = self._writer.stats(xp.data._zarr_array)
+                if nbytes == 0 and dropped == 0:
+                    continue
+                stored = xp.data._zarr_array.nbytes_stored() - metadata_bytes
+                xp.attrs["compression"] = dict(
+                    codec=codec,
+                    # Achieved throughput over the time the array had writes queued or in flight.
+                    mb_per_s=nbytes / max(busy, 1e-9) / 1e6,
+                    # Throughput of a single writer thread, the writer runs write_threads of
+                    # these concurrently.
+                    thread_mb_per_s=nbytes / max(seconds, 1e-9) / 1e6,
+                    ratio=nbytes / max(stored, 1),
+                    threads=self._write_threads,
+                )
+                # Tiles the drop_oldest write policy threw away to stay within the write budget.
+                xp.attrs["dropped"] = dropped
+        self.sync_metadata(force=True)
+
     @property
     def arrays(self):
         with self._array_lock:
@@ -168,11 +623,13 @@ class LiveClient:
     def __init__(self, viewer, relay, widgets):
         self._viewer = viewer
         self._relay = relay
-        img = self._relay.get("img")
+        self._frames = FrameBuffer(**self._relay.get("frames"))
+        img = None
+        while img is None:
+            slot, self._seq = self._relay.get("img")
+            img = self._frames.read(slot, self._seq)
         self._viewer.add_image(img, name="live")
-        self._timer = QTimer()
-        self._timer.timeout.connect(self.update_img)
-        self._timer.start(1000 // 30)
+        self._relay.subscribe("img", self.update_img)
         tabify = False
         for name, widget in widgets.items():
             self._viewer.window.add_dock_widget(
@@ -180,26 +637,43 @@ class LiveClient:
             )
             tabify = True
 
-    def update_img(self):
-        img = self._relay.get("img")
-        self._viewer.layers[0].data = img
+    def update_img(self, latest):
+        slot, seq = latest
+        if seq != self._seq:
+            img = self._frames.read(slot, seq)
+            # Torn frames get dropped, a newer one is already on its way.
+            if img is not None:
+                self._seq = seq
+                self._viewer.layers[0].data = img
+
+
+def load_widgets(ctrl, headless=False):
+    # Widgets only exist in the viewer, so headless runs skip them and never import Qt.
+    if headless:
+        return {}, {}, {}
+    from .widgets import init_widgets
+
+    return init_widgets(ctrl)
 
 
 def live(ctrl):
-    widgets, widget_routes = init_widgets(ctrl)
+    widgets, widget_routes, widget_watches = load_widgets(ctrl)
     gui = GUI(lambda v, r: LiveClient(v, r, widgets=widgets))
 
-    img = ctrl.snap()
+    img = gui.frame_buffer(ctrl.snap())
 
     @gui.worker
     def snap():
-        while True:
-            img[:] = ctrl.snap()
-            yield
+        with contextlib.closing(ctrl.stream()) as frames:
+            for frame in frames:
+                img.put(frame.img)
+                gui.publish("img", img.latest)
+                yield
 
-    gui.route("img", lambda: img)
     for name, func in widget_routes.items():
-        gui.route(name, func)
+        gui.route(name, func, timeout=ROUTE_TIMEOUT)
+    for name, func in widget_watches.items():
+        gui.watch(name, func)
 
     gui.start()
 
@@ -208,20 +682,27 @@ def live(ctrl):
 
 class AcqClient:
     def __init__(self, viewer, relay, file, widgets, tiled=False, multi=False):
+        from qtpy.QtCore import QTimer
+
+        from .widgets import BoundarySelector, PositionSelector
+
         self._viewer = viewer
         self._relay = relay
         self._file = file
-        self._live_timer = QTimer()
         self._refresh_timer = QTimer()
         self._arrays = set()
+        self._dirty = False
         self._imgs = {}
         self._contrast_set = set()
 
         if tiled or multi:
-            img = self._relay.get("img")
+            self._frames = FrameBuffer(**self._relay.get("frames"))
+            img = None
+            while img is None:
+                slot, self._seq = self._relay.get("img")
+                img = self._frames.read(slot, self._seq)
             self._viewer.add_image(img, name="live")
-            self._live_timer.timeout.connect(self.update_img)
-            self._live_timer.start(1000 // 30)
+            self._relay.subscribe("img", self.update_img)
             if tiled:
                 self._viewer.window.add_dock_widget(
                     BoundarySelector(self._relay, self.start_acq),
@@ -234,9 +715,13 @@ class AcqClient:
                     name="Acquisition Positions",
                     tabify=False,
                 )
-        else:
-            self._refresh_timer.timeout.connect(self.refresh)
-            self._refresh_timer.start(1000)
+
+        self._relay.subscribe("arrays", self.add_arrays)
+        self._relay.subscribe("written", self.mark_dirty)
+        self.add_arrays(self._relay.get("arrays"))
+        # Layers get refreshed at most once a second and only if new data was written.
+        self._refresh_timer.timeout.connect(self.refresh)
+        self._refresh_timer.start(1000)
 
         tabify = False
         for name, widget in widgets.items():
@@ -246,46 +731,25 @@ class AcqClient:
             tabify = True
 
     def start_acq(self, *args):
-        self._live_timer.disconnect()
-        self._live_timer.stop()
+        self._relay.unsubscribe("img")
         self._viewer.layers.remove("live")
-
         self._relay.post("start_acq", *args)
-        self._refresh_timer.timeout.connect(self.refresh)
-        self._refresh_timer.start(1000)
 
-    def refresh(self):
-        arrays = self._relay.get("arrays")
+    def mark_dirty(self, _):
+        self._dirty = True
+
+    def add_arrays(self, arrays):
         new_arrays = arrays - self._arrays
         self._arrays = arrays.union(self._arrays)
         for arr in new_arrays:
-            xp = xr.open_zarr(self._file, group=arr)
-            xp = xp["tile"].assign_attrs(xp.attrs)
-            img = tiles_to_image(xp)
-
-            layer_names = arr
-            if "channel" in img.dims:
-                layer_names = [f"{arr}: {c}" for c in xp.coords["channel"].to_numpy()]
-
-            viewer_dims = self._viewer.dims.axis_labels[:-2] + ("y", "x")
-            img = img.expand_dims([d for d in viewer_dims if d not in img.dims])
-            img = img.transpose("channel", ..., *viewer_dims, missing_dims="ignore")
-
-            self._viewer.add_image(
-                img,
-                channel_axis=0 if "channel" in img.dims else None,
-                name=layer_names,
-                multiscale=False,
-                cache=False,
-            )
-            new_dims = tuple(d for d in img.dims if d not in viewer_dims and d != "channel")
-            self._viewer.dims.axis_labels = new_dims + viewer_dims
-            # Make sure new dimension sliders get initialized to be 0.
-            self._viewer.dims.current_step = (0,) * len(new_dims) + self._viewer.dims.current_step[
-                -len(new_dims) :
-            ]
             # Save this array so we can set the contrast limits once a nonzero element gets added.
-            self._imgs[arr] = img
+            self._imgs[arr] = add_layers(self._viewer, self._file, arr)
+            self._dirty = True
+
+    def refresh(self):
+        if not self._dirty:
+            return
+        self._dirty = False
 
         """
         # Set contrast limits when a layer gets updated for the first time.
@@ -308,9 +772,76 @@ class AcqClient:
         for layer in self._viewer.layers:
             layer.refresh()
 
-    def update_img(self):
-        img = self._relay.get("img")
-        self._viewer.layers[0].data = img
+    def update_img(self, latest):
+        slot, seq = latest
+        if seq != self._seq:
+            img = self._frames.read(slot, seq)
+            # Torn frames get dropped, a newer one is already on its way.
+            if img is not None:
+                self._seq = seq
+                self._viewer.layers[0].data = img
+
+
+def add_layers(viewer, file, arr):
+    xp = xr.open_zarr(file, group=arr)
+    xp = xp["tile"].assign_attrs(xp.attrs)
+    img = tiles_to_image(xp)
+
+    layer_names = arr
+    if "channel" in img.dims:
+        layer_names = [f"{arr}: {c}" for c in xp.coords["channel"].to_numpy()]
+
+    viewer_dims = viewer.dims.axis_labels[:-2] + ("y", "x")
+    img = img.expand_dims([d for d in viewer_dims if d not in img.dims])
+    img = img.transpose("channel", ..., *viewer_dims, missing_dims="ignore")
+
+    viewer.add_image(
+        img,
+        channel_axis=0 if "channel" in img.dims else None,
+        name=layer_names,
+        multiscale=False,
+        cache=False,
+    )
+    new_dims = tuple(d for d in img.dims if d not in viewer_dims and d != "channel")
+    viewer.dims.axis_labels = new_dims + viewer_dims
+    # Make sure new dimension sliders get initialized to be 0.
+    viewer.dims.current_step = (0,) * len(new_dims) + viewer.dims.current_step[-len(new_dims) :]
+    return img
+
+
+class FileClient:
+    def __init__(self, viewer, file, interval=1.0):
+        from qtpy.QtCore import QTimer
+
+        self._viewer = viewer
+        self._file = file
+        self._arrays = set()
+        self._timer = QTimer()
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(int(1000 * interval))
+        self.refresh()
+
+    @property
+    def viewer(self):
+        return self._viewer
+
+    def refresh(self):
+        # Pick up arrays and data that an acquisition, possibly a headless one in some other
+        # process, has written to disk since we last looked.
+        arrays = set(zr.open_group(self._file, mode="r").group_keys())
+        for arr in sorted(arrays - self._arrays):
+            add_layers(self._viewer, self._file, arr)
+        self._arrays |= arrays
+        for layer in self._viewer.layers:
+            layer.refresh()
+
+
+def view(file, interval=1.0):
+    import napari
+
+    client = FileClient(napari.Viewer(), file, interval)
+    napari.run()
+    return client
 
 
 def run(run_func):
@@ -342,136 +873,263 @@ def run(run_func):
     return Runner()
 
 
-def acq(ctrl, file, acq_func):
-    widgets, widget_routes = init_widgets(ctrl)
+def acq(
+    ctrl,
+    file,
+    acq_func,
+    write_budget=1 << 30,
+    write_policy="block",
+    codec="balanced",
+    headless=False,
+):
+    widgets, widget_routes, widget_watches = load_widgets(ctrl, headless)
+
+    def init_client(viewer, relay):
+        return AcqClient(viewer, relay, file=file, widgets=widgets)
+
     gui = GUI(
-        lambda v, r: AcqClient(v, r, file=file, widgets=widgets),
+        None if headless else init_client,
         file,
         ctrl.snap(),
         dict(acq_func=dill.source.getsource(acq_func)),
+        write_budget,
+        write_policy,
+        codec=codec,
+        headless=headless,
     )
 
     @gui.worker
     def acq():
-        store = zr.storage.LocalStore(file)
-        for _ in acq_func(gui):
-            for name, xp in gui.arrays.items():
-                xp.to_dataset(promote_attrs=True, name="tile").to_zarr(
-                    store, group=name, compute=False, mode="a"
-                )
-            yield
+        try:
+            for _ in acq_func(gui):
+                gui.sync_metadata()
+                yield
+        finally:
+            # Wait for every queued write and metadata change to land on disk before the
+            # acquisition finishes.
+            gui.flush()
 
     gui.route("arrays", lambda: set(gui.arrays.keys()))
     for name, func in widget_routes.items():
-        gui.route(name, func)
+        gui.route(name, func, timeout=ROUTE_TIMEOUT)
+    for name, func in widget_watches.items():
+        gui.watch(name, func)
 
     gui.start()
     return gui
 
 
-def multi_acq(ctrl, file, acq_func, overlap=0.0):
-    tile = ctrl.snap()
-    pos = [None]
+def multi_acq(
+    ctrl,
+    file,
+    acq_func,
+    overlap=0.0,
+    write_budget=1 << 30,
+    write_policy="block",
+    codec="balanced",
+    positions=None,
+    headless=False,
+    order=None,
+    focus_map=None,
+):
+    if order is not None and order not in paths.POSITION_ORDERS:
+        raise ValueError(
+            f"Unknown position order {order}, expected one of {paths.POSITION_ORDERS}."
+        )
+    pos = [positions]
+    get_pos = positions is None
+    if headless and get_pos:
+        raise ValueError("Headless acquisitions need positions to be specified.")
     acq_event = threading.Event()
 
-    widgets, widget_routes = init_widgets(ctrl)
+    widgets, widget_routes, widget_watches = load_widgets(ctrl, headless)
+
+    def init_client(viewer, relay):
+        return AcqClient(viewer, relay, file=file, widgets=widgets, multi=get_pos)
+
     gui = GUI(
-        lambda v, r: AcqClient(v, r, file=file, widgets=widgets, multi=True),
+        None if headless else init_client,
         file,
         ctrl.snap(),
-        dict(overlap=overlap, acq_func=dill.source.getsource(acq_func)),
+        dict(overlap=overlap, acq_func=dill.source.getsource(acq_func), order=order),
+        write_budget,
+        write_policy,
+        codec=codec,
+        headless=headless,
     )
+    tile = gui.frame_buffer(ctrl.snap()) if get_pos else None
 
     @gui.worker
     def acq():
-        while not acq_event.is_set():
-            tile[:] = ctrl.snap()
-            yield
-
-        store = zr.storage.LocalStore(file)
-        for _ in acq_func(gui, pos[0]):
-            for name, xp in gui.arrays.items():
-                xp.to_dataset(promote_attrs=True, name="tile").to_zarr(
-                    store, group=name, compute=False, mode="a"
-                )
-            yield
+        if get_pos:
+            with contextlib.closing(ctrl.stream()) as frames:
+                for frame in frames:
+                    tile.put(frame.img)
+                    gui.publish("img", tile.latest)
+                    yield
+                    if acq_event.is_set():
+                        break
+
+        # acq_func only gets the order to visit positions in if it asked for one so existing
+        # acquisition functions keep working.
+        kwargs = {}
+        if order is not None:
+            kwargs["path"] = paths.position_path(pos[0], order, start=ctrl.xy)
+        if focus_map is not None:
+            if focus_map.anchors is None:
+                focus_map.anchors = focus.position_anchors(pos[0])
+            kwargs["focus_map"] = init_focus_map(gui, ctrl, focus_map)
+
+        try:
+            for _ in acq_func(gui, pos[0], **kwargs):
+                if focus_map is not None:
+                    # acq_func can remeasure the map every time point to follow drift.
+                    gui.set_attr("focus_map", focus_map.attrs)
+                gui.sync_metadata()
+                yield
+        finally:
+            # Wait for every queued write and metadata change to land on disk before the
+            # acquisition finishes.
+            gui.flush()
 
     @gui.route("start_acq")
     def start_acq(xys):
         pos[0] = xys
         acq_event.set()
 
-    gui.route("img", lambda: tile)
-    gui.route("xy", lambda: ctrl.xy)
+    gui.route("xy", lambda: ctrl.xy, timeout=ROUTE_TIMEOUT)
+    gui.watch("xy", lambda: ctrl.xy, interval=0.25)
     gui.route("arrays", lambda: set(gui.arrays.keys()))
     for name, func in widget_routes.items():
-        gui.route(name, func)
+        gui.route(name, func, timeout=ROUTE_TIMEOUT)
+    for name, func in widget_watches.items():
+        gui.watch(name, func)
 
     gui.start()
     return gui
 
 
-def tiled_acq(ctrl, file, acq_func, overlap, top_left=None, bot_right=None):
-    tile = ctrl.snap()
+def tiled_acq(
+    ctrl,
+    file,
+    acq_func,
+    overlap,
+    top_left=None,
+    bot_right=None,
+    write_budget=1 << 30,
+    write_policy="block",
+    codec="balanced",
+    headless=False,
+    order=None,
+    focus_map=None,
+):
+    if order is not None and order not in paths.GRID_ORDERS:
+        raise ValueError(f"Unknown grid order {order}, expected one of {paths.GRID_ORDERS}.")
     pos = [None, None]
     get_pos = top_left is None or bot_right is None
+    if headless and get_pos:
+        raise ValueError("Headless acquisitions need top_left and bot_right to be specified.")
     acq_event = threading.Event()
 
-    widgets, widget_routes = init_widgets(ctrl)
+    widgets, widget_routes, widget_watches = load_widgets(ctrl, headless)
+
+    def init_client(viewer, relay):
+        return AcqClient(viewer, relay, file=file, widgets=widgets, tiled=get_pos)
+
+    img = ctrl.snap()
     # TODO: Write additional attrs e.g. px_len.
     gui = GUI(
-        lambda v, r: AcqClient(v, r, file=file, widgets=widgets, tiled=get_pos),
+        None if headless else init_client,
         file,
-        ctrl.snap(),
-        dict(overlap=overlap, acq_func=dill.source.getsource(acq_func)),
+        img,
+        dict(overlap=overlap, acq_func=dill.source.getsource(acq_func), order=order),
+        write_budget,
+        write_policy,
+        codec=codec,
+        headless=headless,
     )
+    tile = gui.frame_buffer(img) if get_pos else None
 
     @gui.worker
     def acq():
         if get_pos:
-            while not acq_event.is_set():
-                tile[:] = ctrl.snap()
-                yield
-            xs, ys = pos
+            with contextlib.closing(ctrl.stream()) as frames:
+                for frame in frames:
+                    tile.put(frame.img)
+                    gui.publish("img", tile.latest)
+                    yield
+                    if acq_event.is_set():
+                        break
+            # The stream has to stop before anything else (e.g. a focus map) can use the camera.
+            xs, ys = tile_coords(ctrl, *pos, overlap, img.shape)
         else:
-            xs, ys = tile_coords(ctrl, top_left, bot_right, overlap)
+            xs, ys = tile_coords(ctrl, top_left, bot_right, overlap, img.shape)
 
-        store = zr.storage.LocalStore(file)
-        for _ in acq_func(gui, xs, ys):
-            for name, xp in gui.arrays.items():
-                xp.to_dataset(promote_attrs=True, name="tile").to_zarr(
-                    store, group=name, compute=False, mode="a"
-                )
-            yield
+        kwargs = {}
+        if order is not None:
+            kwargs["path"] = paths.grid_path(xs, ys, order, start=ctrl.xy)
+        if focus_map is not None:
+            if focus_map.anchors is None:
+                focus_map.anchors = focus.grid_anchors(xs, ys)
+            kwargs["focus_map"] = init_focus_map(gui, ctrl, focus_map)
+
+        try:
+            for _ in acq_func(gui, xs, ys, **kwargs):
+                if focus_map is not None:
+                    # acq_func can remeasure the map every time point to follow drift.
+                    gui.set_attr("focus_map", focus_map.attrs)
+                gui.sync_metadata()
+                yield
+        finally:
+            # Wait for every queued write and metadata change to land on disk before the
+            # acquisition finishes.
+            gui.flush()
 
     @gui.route("start_acq")
     def start_acq(top_left, bot_right):
-        xs, ys = tile_coords(ctrl, top_left, bot_right, overlap)
-        pos[0] = xs
-        pos[1] = ys
+        # Only store the corners, the worker is still streaming from the camera at this point.
+        pos[0] = top_left
+        pos[1] = bot_right
         acq_event.set()
 
-    gui.route("img", lambda: tile)
-    gui.route("xy", lambda: ctrl.xy)
+    gui.route("xy", lambda: ctrl.xy, timeout=ROUTE_TIMEOUT)
+    gui.watch("xy", lambda: ctrl.xy, interval=0.25)
     gui.route("arrays", lambda: set(gui.arrays.keys()))
     for name, func in widget_routes.items():
-        gui.route(name, func)
+        gui.route(name, func, timeout=ROUTE_TIMEOUT)
+    for name, func in widget_watches.items():
+        gui.watch(name, func)
 
     gui.start()
     return gui
 
 
+def init_focus_map(gui, ctrl, focus_map):
+    # Only measure focus at the anchors if the map hasn't already been fit, e.g. from a previous
+    # acquisition's attrs.
+    if not focus_map.fitted:
+        focus_map.measure(ctrl)
+    gui.set_attr("focus_map", focus_map.attrs)
+    return focus_map
+
+
+def metadata_fingerprint(xp):
+    return pickle.dumps((dict(xp.attrs), {k: v.to_numpy() for k, v in xp.coords.items()}))
+
+
 class DiskArray(da.core.Array):
     __slots__ = tuple()
 
     def __setitem__(self, key, value):
-        self._zarr_array[key] = value
+        if self._shards is not None:
+            self._shards[key] = value
+        else:
+            self._writer.submit(self._zarr_array, key, value)
 
 
-def tile_coords(ctrl, top_left, bot_right, overlap):
-    tile = ctrl.snap()
-    width = tile.shape[1]
-    height = tile.shape[0]
+def tile_coords(ctrl, top_left, bot_right, overlap, shape=None):
+    # Pass the shape of a frame you already have to save a snap.
+    height, width = (ctrl.snap().shape if shape is None else shape)[-2:]
     overlap_x = int(round(overlap * width))
     overlap_y = int(round(overlap * height))
     delta_x = (width - overlap_x) * ctrl.px_len
@@ -0,0 +1,106 @@
+import numpy as np
+
+# snake is serpentine along columns instead of rows, which is faster when the stage's y axis moves
+# faster than its x axis or tiles are taller than they are wide.
+GRID_ORDERS = ("raster", "serpentine", "snake", "tsp")
+POSITION_ORDERS = ("given", "tsp")
+
+
+def grid_path(xs, ys, order="serpentine", start=None):
+    # Returns the (row, col) indices of every tile, i.e. tile (i, j) sits at (xs[j], ys[i]). Paths
+    # start from the corner of the grid closest to start (or tile (0, 0) if start isn't given).
+    rows, cols = len(ys), len(xs)
+    if order == "tsp":
+        ii, jj = np.meshgrid(np.arange(rows), np.arange(cols), indexing="ij")
+        xys = np.stack([np.asarray(xs)[jj.ravel()], np.asarray(ys)[ii.ravel()]], axis=1)
+        return [divmod(int(k), cols) for k in position_path(xys, "tsp", start)]
+    if order == "raster":
+        path = [(i, j) for i in range(rows) for j in range(cols)]
+    elif order == "serpentine":
+        path = [(i, j if i % 2 == 0 else cols - 1 - j) for i in range(rows) for j in range(cols)]
+    elif order == "snake":
+        path = [(i if j % 2 == 0 else rows - 1 - i, j) for j in range(cols) for i in range(rows)]
+    else:
+        raise ValueError(f"Unknown grid order {order}, expected one of {GRID_ORDERS}.")
+    if start is None or rows == 0 or cols == 0:
+        return path
+
+    corners = [(ci, cj) for ci in (0, rows - 1) for cj in (0, cols - 1)]
+    corner_xys = [(xs[cj], ys[ci]) for ci, cj in corners]
+    ci, cj = corners[int(np.argmin(distance(corner_xys, np.asarray(start, dtype=float))))]
+    return [(abs(ci - i), abs(cj - j)) for i, j in path]
+
+
+def position_path(xys, order="tsp", start=None):
+    # Returns the indices of xys in the order they should be visited, starting from the position
+    # closest to start (or the first position if start isn't given).
+    xys = np.asarray(xys, dtype=float).reshape(-1, 2)
+    if order == "given" or len(xys) < 3:
+        return list(range(len(xys)))
+    if order != "tsp":
+        raise ValueError(f"Unknown position order {order}, expected one of {POSITION_ORDERS}.")
+
+    first = 0 if start is None else int(np.argmin(distance(xys, np.asarray(start, dtype=float))))
+    return two_opt(xys, nearest_neighbor(xys, first))
+
+
+def travel_time(xys, speed=5000.0, accel=None, settle=0.0, start=None):
+    # Estimated seconds to visit xys in order. speed is in um/s, accel in um/s^2 and settle is
+    # the number of seconds we wait after every move.
+    xys = np.asarray(xys, dtype=float).reshape(-1, 2)
+    if start is not None:
+        xys = np.concatenate([np.asarray(start, dtype=float).reshape(1, 2), xys])
+    d = distance(xys[:-1], xys[1:])
+    if accel is None:
+        t = d / speed
+    else:
+        # Trapezoidal velocity profile, moves too short to reach full speed are triangular.
+        ramp = speed**2 / accel
+        t = np.where(d > ramp, d / speed + speed / accel, 2 * np.sqrt(d / accel))
+    return float(t.sum() + settle * np.count_nonzero(d))
+
+
+def distance(a, b):
+    # Both axes of an xy stage move at the same time so a move takes as long as its longest axis.
+    return np.abs(np.asarray(a) - np.asarray(b)).max(axis=-1)
+
+
+def nearest_neighbor(xys, first=0):
+    path = [first]
+    left = np.ones(len(xys), dtype=bool)
+    left[first] = False
+    for _ in range(len(xys) - 1):
+        d = np.where(left, distance(xys, xys[path[-1]]), np.inf)
+        nxt = int(np.argmin(d))
+        path.append(nxt)
+        left[nxt] = False
+    return path
+
+
+def two_opt(xys, path, max_passes=50):
+    # Keep reversing segments of the path as long as doing so shortens it. The path is open and
+    # its first position stays fixed.
+    path = np.array(path)
+    n = len(path)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 2):
+            pts = xys[path]
+            a, b = pts[i], pts[i + 1]
+            c = pts[i + 2 :]
+            # Reversing path[i + 1 : j + 1] replaces edges (a, b) and (c, d) with (a, c) and
+            # (b, d), the last position has no d.
+            d = np.concatenate([pts[i + 3 :], c[-1:]])
+            old = distance(a, b) + distance(c, d)
+            new = distance(a, c) + distance(b, d)
+            old[-1] = distance(a, b)
+            new[-1] = distance(a, c[-1])
+            gain = old - new
+            j = int(np.argmax(gain))
+            if gain[j] > 1e-9:
+                j += i + 2
+                path[i + 1 : j + 1] = path[i + 1 : j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return [int(k) for k in path]
@@ -1,6 +1,6 @@
 import functools
 
-from qtpy.QtCore import Qt, QTimer
+from qtpy.QtCore import QObject, Qt, Signal
 from qtpy.QtGui import QDoubleValidator
 from qtpy.QtWidgets import (
     QGridLayout,
@@ -15,21 +15,24 @@ from qtpy.QtWidgets import (
 from . import devices
 
 
+class RelaySignal(QObject):
+    event = Signal(str)
+
+
 def init_widgets(ctrl):
     widgets = {}
     routes = {}
+    watches = {}
 
-    for device in ctrl.devices:
-        if isinstance(device, devices.Valved):
-            path = f"widget/{device.name}"
-            # We need to set a dummy default argument so path's value gets captured by the lambda.
-            widgets[f"{device.name} controller"] = lambda r, path=path: ValveController(
-                r.subpath(path)
-            )
-            server = ValveControllerServer(device)
-            routes = {**routes, **server.routes(path)}
+    for device in ctrl.devices_with(devices.Valved):
+        path = f"widget/{device.name}"
+        # We need to set a dummy default argument so path's value gets captured by the lambda.
+        widgets[f"{device.name} controller"] = lambda r, path=path: ValveController(r.subpath(path))
+        server = ValveControllerServer(device)
+        routes = {**routes, **server.routes(path)}
+        watches = {**watches, **server.watches(path)}
 
-    return widgets, routes
+    return widgets, routes, watches
 
 
 class BoundarySelector(QWidget):
@@ -77,14 +80,23 @@ class BoundarySelector(QWidget):
 
         self._relay = relay
         self._next_step = next_step
+        self._xy = None
+        self._relay.subscribe("xy", self.update_xy)
+
+    def update_xy(self, xy):
+        self._xy = xy
+
+    def get_xy(self):
+        # Use the last published position and only ask the stage if we haven't got one yet.
+        return self._xy if self._xy is not None else self._relay.get("xy")
 
     def set_left(self):
-        xy = self._relay.get("xy")
+        xy = self.get_xy()
         self.left_x.setText(f"{xy[0]:.2f}")
         self.left_y.setText(f"{xy[1]:.2f}")
 
     def set_right(self):
-        xy = self._relay.get("xy")
+        xy = self.get_xy()
         self.right_x.setText(f"{xy[0]:.2f}")
         self.right_y.setText(f"{xy[1]:.2f}")
 
@@ -96,6 +108,7 @@ class BoundarySelector(QWidget):
             and self.right_y.text()
         ):
             self.close()
+            self._relay.unsubscribe("xy", self.update_xy)
             self._next_step(
                 (float(self.left_x.text()), float(self.left_y.text())),
                 (float(self.right_x.text()), float(self.right_y.text())),
@@ -129,6 +142,15 @@ class PositionSelector(QWidget):
 
         self._relay = relay
         self._next_step = next_step
+        self._xy = None
+        self._relay.subscribe("xy", self.update_xy)
+
+    def update_xy(self, xy):
+        self._xy = xy
+
+    def get_xy(self):
+        # Use the last published position and only ask the stage if we haven't got one yet.
+        return self._xy if self._xy is not None else self._relay.get("xy")
 
     def add_row(self):
         row = QHBoxLayout()
@@ -153,7 +175,7 @@ class PositionSelector(QWidget):
     def set(self, row):
         x = row.itemAt(0).widget()
         y = row.itemAt(1).widget()
-        xy = self._relay.get("xy")
+        xy = self.get_xy()
         x.setText(f"{xy[0]:.2f}")
         y.setText(f"{xy[1]:.2f}")
 
@@ -180,6 +202,7 @@ class PositionSelector(QWidget):
 
         if valid:
             self.close()
+            self._relay.unsubscribe("xy", self.update_xy)
             self._next_step(xys)
 
 
@@ -193,9 +216,6 @@ class ValveController(QWidget):
         layout = QGridLayout(self)
         layout.setHorizontalSpacing(0)
         layout.setVerticalSpacing(0)
-        self._timer = QTimer()
-        self._timer.timeout.connect(self.update_valves)
-        self._timer.start(100)
 
         for i, (k, v) in enumerate(self._valves.items()):
             btn = QPushButton(str(k))
@@ -205,8 +225,10 @@ class ValveController(QWidget):
             layout.addWidget(btn, i // 8, i % 8)
             self._valve_btns[k] = btn
 
-    def update_valves(self):
-        self._valves = self._relay.get("valves")
+        self._relay.subscribe("valves", self.update_valves)
+
+    def update_valves(self, valves):
+        self._valves = valves
         for k, v in self._valves.items():
             self._valve_btns[k].setStyleSheet(self.button_stylesheet(v))
 
@@ -231,6 +253,9 @@ class ValveControllerServer:
     def routes(self, path):
         return {path + "/valves": self.get_valves, path + "/set_valve": self.set_valve}
 
+    def watches(self, path):
+        return {path + "/valves": self.get_valves}
+
     def get_valves(self):
         return self._valves.valves
 
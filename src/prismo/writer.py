@@ -0,0 +1,361 @@
+import collections
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import zarr as zr
+
+CODECS = {
+    "fast": dict(cname="lz4", clevel=1),
+    "balanced": dict(cname="zstd", clevel=5),
+    "archive": dict(cname="zstd", clevel=9),
+    "none": None,
+}
+
+
+def compressor(codec):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec}, expected one of {list(CODECS)}.")
+    if CODECS[codec] is None:
+        return None
+    return zr.codecs.BloscCodec(**CODECS[codec], shuffle=zr.codecs.BloscShuffle.bitshuffle)
+
+
+class Writer:
+    def __init__(self, max_bytes=1 << 30, policy="block", threads=4, spill_dir=None, callback=None):
+        if policy not in ("block", "drop_oldest", "spill"):
+            raise ValueError(f"Unknown write policy {policy}.")
+
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.dropped = 0
+        # Called with the zarr array from a writer thread every time a write lands.
+        self._callback = callback
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._in_flight = []
+        self._counter = itertools.count()
+        self._pending_bytes = 0
+        self._stats = {}
+        self._error = None
+        self._closed = False
+        self._spill_dir = spill_dir
+        # Spill files that are still being saved.
+        self._saving = set()
+        self._own_spill_dir = False
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, zarr_array, key, value, copy=True):
+        # Copy the value since callers are free to reuse their buffers once we return.
+        value = np.array(value) if copy else np.asarray(value)
+        nbytes = value.nbytes
+        region = write_region(zarr_array, key)
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Writer is closed.")
+            self._raise_error()
+            spill = False
+            if self._pending_bytes + nbytes > self.max_bytes:
+                if self.policy == "drop_oldest":
+                    while self._pending_bytes + nbytes > self.max_bytes and self._drop_oldest():
+                        pass
+                elif self.policy == "spill":
+                    spill = True
+                self._cond.wait_for(
+                    lambda: (
+                        spill
+                        or self._error is not None
+                        or self._pending_bytes == 0
+                        or self._pending_bytes + nbytes <= self.max_bytes
+                    )
+                )
+                self._raise_error()
+
+            self._start(zarr_array)
+            if spill:
+                # Queue the write right away so it keeps its place among writes to the same
+                # chunks, but writer threads skip it until the file is saved.
+                path = os.path.join(self._get_spill_dir(), f"{next(self._counter)}.npy")
+                item = (region, zarr_array, key, path, 0)
+                self._saving.add(path)
+                self._queue.append(item)
+            else:
+                self._pending_bytes += nbytes
+                self._queue.append((region, zarr_array, key, value, nbytes))
+                self._cond.notify_all()
+                return
+
+        # Nobody else has to wait on the disk while we save.
+        try:
+            np.save(path, value)
+        except Exception:
+            with self._cond:
+                self._queue.remove(item)
+                self._finish(zarr_array)
+                raise
+        finally:
+            with self._cond:
+                self._saving.discard(path)
+                self._cond.notify_all()
+
+    def flush(self):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: (not self._in_flight and not self._queue) or self._error is not None
+            )
+            self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            for thread in self._threads:
+                thread.join()
+            if self._own_spill_dir:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+    @property
+    def pending_bytes(self):
+        return self._pending_bytes
+
+    def stats(self, zarr_array):
+        # Returns the number of uncompressed bytes written to the array, the total number of
+        # seconds writer threads spent compressing and storing them, the number of writes that
+        # got dropped and the wall clock seconds the array had writes queued or in flight.
+        with self._cond:
+            nbytes, seconds, dropped, busy, pending, since = self._array_stats(zarr_array)
+            if pending:
+                busy += time.perf_counter() - since
+            return nbytes, seconds, dropped, busy
+
+    def _run(self):
+        while True:
+            with self._cond:
+                item = self._next_item()
+                while item is None:
+                    if self._closed and not self._queue:
+                        return
+                    self._cond.wait()
+                    item = self._next_item()
+                region, zarr_array, key, value, nbytes = item
+                self._in_flight.append(region)
+
+            error = None
+            start = time.perf_counter()
+            try:
+                if isinstance(value, str):
+                    path = value
+                    value = np.load(path)
+                    os.remove(path)
+                zarr_array[key] = value
+            except Exception as e:
+                error = e
+            duration = time.perf_counter() - start
+
+            with self._cond:
+                self._in_flight.remove(region)
+                self._pending_bytes -= nbytes
+                if error is None:
+                    stats = self._array_stats(zarr_array)
+                    stats[0] += value.nbytes
+                    stats[1] += duration
+                self._finish(zarr_array)
+                if error is not None and self._error is None:
+                    self._error = error
+                self._cond.notify_all()
+
+            if error is None and self._callback is not None:
+                self._callback(zarr_array)
+
+    def _next_item(self):
+        # Take the oldest write that doesn't touch a chunk (or shard) that an in flight or older
+        # queued write touches. Writes to the same chunk are then applied in submission order,
+        # and sharded arrays never have two threads rewriting the same shard.
+        blocked = list(self._in_flight)
+        for i, item in enumerate(self._queue):
+            region = item[0]
+            saving = isinstance(item[3], str) and item[3] in self._saving
+            if not saving and not any(regions_overlap(region, other) for other in blocked):
+                del self._queue[i]
+                return item
+            blocked.append(region)
+        return None
+
+    def _drop_oldest(self):
+        for i, item in enumerate(self._queue):
+            if not isinstance(item[3], str):
+                del self._queue[i]
+                self._pending_bytes -= item[4]
+                self.dropped += 1
+                self._array_stats(item[1])[2] += 1
+                self._finish(item[1])
+                return True
+        return False
+
+    def _array_stats(self, zarr_array):
+        # [bytes, thread seconds, dropped, busy seconds, pending writes, busy since]
+        return self._stats.setdefault(id(zarr_array), [0, 0.0, 0, 0.0, 0, 0.0])
+
+    def _start(self, zarr_array):
+        stats = self._array_stats(zarr_array)
+        if stats[4] == 0:
+            stats[5] = time.perf_counter()
+        stats[4] += 1
+
+    def _finish(self, zarr_array):
+        stats = self._array_stats(zarr_array)
+        stats[4] -= 1
+        if stats[4] == 0:
+            stats[3] += time.perf_counter() - stats[5]
+
+    def _get_spill_dir(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="prismo-spill-")
+            self._own_spill_dir = True
+        os.makedirs(self._spill_dir, exist_ok=True)
+        return self._spill_dir
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+
+class ShardBuffer:
+    def __init__(self, zarr_array, writer):
+        self._array = zarr_array
+        self._writer = writer
+        # Partially filled shards as [data, filled, last write time], least recently written first.
+        self._shards = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        # Every dimension except the last two indexes whole tiles.
+        self._shard_shape = zarr_array.shards[:-2]
+
+    def __setitem__(self, key, value):
+        idx = self._tile_index(key)
+        if idx is None:
+            # Anything other than a single tile write gets written directly, but buffered tiles
+            # have to be queued first so the two are applied in order.
+            self.flush()
+            self._writer.submit(self._array, key, value)
+            return
+
+        shard = tuple(i // s for i, s in zip(idx, self._shard_shape, strict=True))
+        start = tuple(i * s for i, s in zip(shard, self._shard_shape, strict=True))
+        local = tuple(i - s for i, s in zip(idx, start, strict=True))
+        partial = []
+        with self._lock:
+            if shard not in self._shards:
+                shape = tuple(
+                    min(s, n - o)
+                    for s, n, o in zip(self._shard_shape, self._array.shape, start, strict=False)
+                )
+                data = np.full(
+                    shape + self._array.shape[-2:], self._array.fill_value, self._array.dtype
+                )
+                self._shards[shard] = [data, np.zeros(shape, dtype=bool), None]
+                self._nbytes += data.nbytes
+
+            item = self._shards.pop(shard)
+            data, filled, _ = item
+            data[local] = value
+            filled[local] = True
+            full = filled.all()
+            if full:
+                self._nbytes -= data.nbytes
+            else:
+                item[2] = time.monotonic()
+                self._shards[shard] = item
+                # Buffered shards count against the write budget too, so once they don't fit
+                # next to the queued writes the least recently written ones get written out
+                # tile by tile.
+                while self._shards and (
+                    self._writer.pending_bytes + self._nbytes > self._writer.max_bytes
+                ):
+                    partial.append(self._pop(next(iter(self._shards))))
+
+        if partial:
+            self._submit_tiles(partial)
+        if not full:
+            return
+
+        # Tiles can arrive in any order so we only write a shard once all of its tiles are in,
+        # that way zarr never has to read back and rewrite a partially filled shard.
+        key = tuple(slice(o, o + n) for o, n in zip(start, filled.shape, strict=True))
+        self._writer.submit(self._array, key, data, copy=False)
+
+    def flush(self, older_than=None):
+        # Write out the buffered tiles of partially filled shards, or only of those that haven't
+        # been written to for older_than seconds.
+        now = time.monotonic()
+        with self._lock:
+            shards = [
+                self._pop(shard)
+                for shard, (_, _, touched) in list(self._shards.items())
+                if older_than is None or now - touched >= older_than
+            ]
+        self._submit_tiles(shards)
+
+    def _pop(self, shard):
+        data, filled, _ = self._shards.pop(shard)
+        self._nbytes -= data.nbytes
+        return shard, data, filled
+
+    def _submit_tiles(self, shards):
+        for shard, data, filled in shards:
+            start = tuple(i * s for i, s in zip(shard, self._shard_shape, strict=True))
+            for local in zip(*np.nonzero(filled), strict=True):
+                key = tuple(int(o + i) for o, i in zip(start, local, strict=True))
+                self._writer.submit(self._array, key, data[local], copy=False)
+
+    def _tile_index(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        if len(key) > self._array.ndim:
+            return None
+        key = key + (slice(None),) * (self._array.ndim - len(key))
+        idx = []
+        for k, n in zip(key[:-2], self._array.shape, strict=False):
+            if not isinstance(k, int | np.integer):
+                return None
+            idx.append(int(k) % n)
+        for k, n in zip(key[-2:], self._array.shape[-2:], strict=True):
+            if not isinstance(k, slice) or k.indices(n) != (0, n, 1):
+                return None
+        return tuple(idx)
+
+
+def write_region(zarr_array, key):
+    key = key if isinstance(key, tuple) else (key,)
+    chunks = zarr_array.shards or zarr_array.chunks
+    region = []
+    for i, (size, n) in enumerate(zip(chunks, zarr_array.shape, strict=True)):
+        k = key[i] if i < len(key) else slice(None)
+        if isinstance(k, int | np.integer):
+            start = int(k) % n
+            stop = start + 1
+        elif isinstance(k, slice) and k.step in (None, 1):
+            start, stop, _ = k.indices(n)
+            stop = max(start + 1, stop)
+        else:
+            # Be conservative with fancy indexing and assume we touch the whole dimension.
+            start, stop = 0, n
+        region.append((start // size, (stop - 1) // size + 1))
+    return id(zarr_array), tuple(region)
+
+
+def regions_overlap(a, b):
+    return a[0] == b[0] and all(
+        s1 < e2 and s2 < e1 for (s1, e1), (s2, e2) in zip(a[1], b[1], strict=True)
+    )